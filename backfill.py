@@ -0,0 +1,180 @@
+"""
+Loads archived genary.json snapshots into the database.
+
+Snapshots are read from directories, tarballs or single files, parsed in a
+process pool and written by this process in batches, one transaction per
+batch. Every stored file is recorded in backfill_sources by its absolute
+path (a tarball member as tarball:member), so a second run from any
+directory skips what the first one finished and retries files that failed
+to parse; a batch interrupted before its sources were recorded is simply
+inserted again and its rows ignored as duplicates.
+
+With POWER_RETENTION_DAYS set, the server folds per-plant rows older than
+the window on its next retention run, backfilled ones included; only the
+plant totals and the plant_hourly / plant_daily rollups of them stay.
+
+    python backfill.py archive/2023 archive-2024.tar.gz
+    python backfill.py --workers 8 --batch 500 archive/
+"""
+import os
+import json
+import time
+import tarfile
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, List, Set, Tuple, Union
+
+import db_helper
+from taipower import parse_timestamp, parse_records
+
+logger = logging.getLogger(__name__)
+
+# (source, path of the file or its contents)
+Item = Tuple[str, Union[str, bytes]]
+
+def get_done_sources(conn) -> Set[str]:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_sources (
+            source TEXT PRIMARY KEY,
+            timestamp TEXT
+        )
+    ''')
+    conn.commit()
+    return {row["source"] for row in conn.execute("SELECT source FROM backfill_sources")}
+
+def iter_sources(paths: List[str], done: Set[str]) -> Iterator[Item]:
+    """Every snapshot under paths that is not done yet, in name order per path."""
+    for path in paths:
+        # Sources are recorded by absolute path, whichever directory the run starts from
+        path = os.path.realpath(path)
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    source = os.path.join(root, name)
+                    if name.endswith(".json") and source not in done:
+                        yield source, source
+        elif tarfile.is_tarfile(path):
+            # Members are read here, a tarball can only be walked in order
+            with tarfile.open(path, "r:*") as tar:
+                for member in tar:
+                    source = f"{path}:{member.name}"
+                    if member.isfile() and member.name.endswith(".json") and source not in done:
+                        yield source, tar.extractfile(member).read()
+        elif path not in done:
+            yield path, path
+
+def parse_items(items: List[Item]) -> List[Tuple]:
+    """
+    Runs in the worker processes. Returns (source, timestamp, records) per
+    snapshot, timestamp and records are None for a file that fails to parse.
+    """
+    results = []
+    for source, payload in items:
+        try:
+            if isinstance(payload, str):
+                with open(payload, "rb") as file:
+                    payload = file.read()
+            data = json.loads(payload)
+            timestamp = parse_timestamp(data)
+            results.append((source, timestamp, parse_records(data, timestamp)))
+        except Exception as e:
+            logger.error(f"[backfill] {source}: {e}")
+            results.append((source, None, None))
+    return results
+
+def chunked(items: Iterator[Item], size: int) -> Iterator[List[Item]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class Writer:
+    """Collects parsed snapshots and stores them a batch at a time."""
+    def __init__(self, batch: int):
+        self.batch = batch
+        self.pending = []
+        self.snapshots = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    def add(self, results: List[Tuple]):
+        self.pending.extend(results)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        records = [record for _, _, parsed in self.pending if parsed for record in parsed]
+        inserted, duplicates = db_helper.insert_records(records)
+        with db_helper.get_db_connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO backfill_sources (source, timestamp) VALUES (?, ?)
+            ''', [(source, timestamp) for source, timestamp, _ in self.pending if timestamp])
+        self.snapshots += sum(1 for _, timestamp, _ in self.pending if timestamp)
+        self.failed += sum(1 for _, timestamp, _ in self.pending if timestamp is None)
+        self.inserted += inserted
+        self.duplicates += duplicates
+        self.pending = []
+
+def backfill(paths: List[str], workers: int, batch: int = 256, chunk: int = 16) -> dict:
+    writer = Writer(batch)
+    done = get_done_sources(db_helper.get_db_connection())
+    start = last_report = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = set()
+        # A bounded window of chunks in flight keeps a large tarball from
+        # being read into memory ahead of the workers
+        for items in chunked(iter_sources(paths, done), chunk):
+            running.add(pool.submit(parse_items, items))
+            if len(running) < workers * 4:
+                continue
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                writer.add(future.result())
+
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                last_report = now
+                logger.info(f"[backfill] {writer.snapshots} snapshots, {writer.snapshots / (now - start):.1f} snapshots/s")
+
+        for future in running:
+            writer.add(future.result())
+    writer.flush()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "snapshots": writer.snapshots,
+        "failed": writer.failed,
+        "skipped": len(done),
+        "inserted": writer.inserted,
+        "duplicates": writer.duplicates,
+        "seconds": round(elapsed, 1),
+        "snapshots_per_second": round(writer.snapshots / elapsed, 1) if elapsed else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load archived genary.json snapshots.")
+    parser.add_argument("paths", nargs="+", help="directories, tarballs or json files")
+    parser.add_argument("--db", default=db_helper.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parser processes")
+    parser.add_argument("--batch", type=int, default=256, help="snapshots per transaction")
+    parser.add_argument("--chunk", type=int, default=16, help="snapshots per worker task")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db_helper.DB_PATH = args.db
+    db_helper.init_db()
+    print(backfill(args.paths, args.workers, args.batch, args.chunk))
+    db_helper.close_db_connection()
+
+if __name__ == "__main__":
+    main()
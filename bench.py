@@ -0,0 +1,256 @@
+"""
+Benchmarks of the hot paths on a synthetic database.
+
+    python bench.py --days 30 --output before.json
+    python bench.py --days 30 --compare before.json   # exit 1 on a regression
+
+The database is generated per size under data/bench and reused while its
+last snapshot is within the hour (the summary window and the plots end at the
+current time); every run works on a copy, so ingest timings do not depend on
+earlier runs. The read path of main and the render benchmarks are skipped
+when pycairo is missing, main imports it through draw.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+import db_helper
+from taipower import parse_timestamp, parse_records
+
+BENCH_DIR = os.path.join("data", "bench")
+SNAPSHOT_MINUTES = 10
+
+# Rough share of ~200 plants per type
+PLANT_COUNTS = {
+    "nuclear": 2, "coal": 20, "cogen": 18, "ippcoal": 8, "lng": 30, "ipplng": 12,
+    "oil": 6, "diesel": 10, "hydro": 30, "wind": 25, "solar": 24,
+    "OtherRenewableEnergy": 8, "EnergyStorageSystem": 6, "EnergyStorageSystemLoad": 5,
+}
+
+def make_plants(seed: int = 1) -> List[Dict]:
+    rng = random.Random(seed)
+    return [
+        {"name": f"{type}#{i}", "type": type, "capacity": round(rng.uniform(20, 1100), 1)}
+        for type, count in PLANT_COUNTS.items() for i in range(count)
+    ]
+
+def load_factor(type: str, when: datetime, rng: random.Random) -> float:
+    hour = when.hour + when.minute / 60
+    if type == "solar":
+        return max(0.0, math.sin((hour - 6) / 12 * math.pi)) * rng.uniform(0.6, 0.9)
+    if type == "wind":
+        return rng.uniform(0.1, 0.6)
+    if type.startswith("EnergyStorage"):
+        return rng.uniform(0, 0.3)
+    # Thermal and hydro follow the evening peak
+    return 0.55 + 0.3 * math.sin((hour - 13) / 24 * 2 * math.pi) + rng.uniform(-0.05, 0.05)
+
+def make_snapshot(plants: List[Dict], when: datetime, rng: random.Random) -> Dict:
+    """A genary.json snapshot in the format Taipower publishes."""
+    rows, grid_capacity, grid_generation = [], 0.0, 0.0
+    by_type = {}
+    for plant in plants:
+        generation = round(plant["capacity"] * load_factor(plant["type"], when, rng), 1)
+        by_type.setdefault(plant["type"], []).append((plant, generation))
+        grid_capacity += plant["capacity"]
+        grid_generation += generation
+    for type, members in by_type.items():
+        element = f"<A NAME='{type}'></A><b>{type}</b>"
+        for plant, generation in members:
+            factor = generation / plant["capacity"] * 100
+            rows.append([element, "", plant["name"], str(plant["capacity"]), str(generation), f"{factor:.3f}%", "", ""])
+        capacity = sum(plant["capacity"] for plant, _ in members)
+        generation = sum(generation for _, generation in members)
+        rows.append([element, "", "小計",
+                     f"{capacity:.1f}({capacity / grid_capacity * 100:.3f}%)",
+                     f"{generation:.1f}({generation / max(grid_generation, 1) * 100:.3f}%)", "", "", ""])
+    return {"": when.strftime("%Y-%m-%d %H:%M"), "aaData": rows}
+
+def generate_db(path: str, days: int, seed: int = 1) -> str:
+    """Fills a new database at path with `days` of snapshots ending now."""
+    rng = random.Random(seed)
+    plants = make_plants(seed)
+    end = datetime.now().replace(second=0, microsecond=0)
+    end -= timedelta(minutes=end.minute % SNAPSHOT_MINUTES)
+    when = end - timedelta(days=days)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db_helper.close_db_connection()
+    db_helper.DB_PATH = path
+    db_helper.init_db()
+
+    start = time.perf_counter()
+    batch = []
+    while when <= end:
+        data = make_snapshot(plants, when, rng)
+        batch.extend(parse_records(data, parse_timestamp(data)))
+        when += timedelta(minutes=SNAPSHOT_MINUTES)
+        # A day per transaction
+        if len(batch) >= len(plants) * 144 or when > end:
+            db_helper.insert_records(batch)
+            batch = []
+    print(f"Generated {path} with {days} days in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    db_helper.close_db_connection()
+    return path
+
+def is_current(path: str) -> bool:
+    """The summary window and the plots end now, a database from an earlier day misses them."""
+    if not os.path.exists(path):
+        return False
+    with sqlite3.connect(path) as conn:
+        latest = conn.execute("SELECT MAX(timestamp) FROM summary_by_timestamp").fetchone()[0]
+    return latest is not None and datetime.fromisoformat(latest) > datetime.now() - timedelta(hours=1)
+
+def measure(func: Callable, repeat: int, setup: Callable = None) -> Dict:
+    times = []
+    for i in range(repeat):
+        args = setup(i) if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(times), 4),
+        "min_ms": round(min(times), 4),
+        "mean_ms": round(statistics.fmean(times), 4),
+        "runs": repeat,
+    }
+
+def run_benchmarks(path: str, repeat: int, sizes: List[tuple]) -> Dict:
+    db_helper.close_db_connection()
+    db_helper.DB_PATH = path
+    results = {}
+    rng = random.Random(2)
+    plants = make_plants()
+    latest = datetime.fromisoformat(db_helper.get_latest_timestamp())
+
+    snapshot = make_snapshot(plants, latest, rng)
+    results["parse"] = measure(lambda: parse_records(snapshot, parse_timestamp(snapshot)), repeat)
+
+    # New snapshots after the latest one, each into its own timestamp
+    def next_records(i):
+        data = make_snapshot(plants, latest + timedelta(minutes=SNAPSHOT_MINUTES * (i + 1)), rng)
+        return (parse_records(data, parse_timestamp(data)), )
+    results["ingest"] = measure(db_helper.insert_records, repeat, next_records)
+
+    now = datetime.now()
+    window = ((now.date() - timedelta(days=2)).isoformat(), (now.date() + timedelta(days=1)).isoformat())
+    # The database fallback of main.get_summary, the read path itself is timed below
+    results["summary_db"] = measure(lambda: db_helper.summary_rows_to_dict(db_helper.get_summary_by_time_range(*window)), repeat)
+    since = (now - timedelta(hours=1)).isoformat()
+    results["summary_since"] = measure(lambda: db_helper.get_summary_since(since), repeat)
+    month = ((now - timedelta(days=30)).isoformat(), now.isoformat())
+    results["rollup_day"] = measure(lambda: db_helper.get_rollup_by_time_range("day", *month), repeat)
+    results["latest_record"] = measure(db_helper.get_latest_summary_record, repeat)
+    day = ((now - timedelta(days=1)).isoformat(), now.isoformat())
+    results["records_1d"] = measure(lambda: db_helper.get_records_by_time_range(*day), max(1, repeat // 5))
+
+    try:
+        # main needs cairo through draw
+        import main
+        from draw import plot_generation, PlotType, DitheringType
+    except ImportError as e:
+        print(f"Skipping read path and render benchmarks: {e}", file=sys.stderr)
+        return results
+
+    # As in the leader after an ingest: data version set, recent rows in the ring
+    main.set_data_version(db_helper.get_latest_timestamp())
+    main.update_recent(main.data_version)
+    results["summary"] = measure(main.get_summary, repeat)
+    results["summary_since_recent"] = measure(lambda: main.get_summary_since(since), repeat)
+    results["latest_total"] = measure(main.get_latest_total, repeat)
+
+    data = main.get_summary()
+    for plot_type in PlotType:
+        for width, height in sizes:
+            results[f"render_{plot_type.name.lower()}_{width}x{height}"] = measure(
+                lambda: plot_generation(data, plot_type, width, height, DitheringType.NONE), repeat)
+    return results
+
+def metadata(path: str, days: int) -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "days": days,
+        "db_bytes": os.path.getsize(path),
+    }
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> bool:
+    """Prints median changes against baseline, returns False if any got slower than threshold."""
+    ok = True
+    print(f"{'benchmark':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>12} {current['median_ms']:>10.3f}ms {'new':>8}")
+            continue
+        change = current["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{name:<40} {before['median_ms']:>10.3f}ms {current['median_ms']:>10.3f}ms {change:>+7.1%}{flag}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing, ingest, queries and rendering.")
+    parser.add_argument("--days", type=int, default=30, help="days of synthetic snapshots")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per benchmark")
+    parser.add_argument("--sizes", default="780x460,800x480", help="render sizes, WxH,WxH")
+    parser.add_argument("--regenerate", action="store_true", help="rebuild the synthetic database")
+    parser.add_argument("--output", help="write the results here as JSON, default stdout")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown of a median")
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes.split(",")]
+    source = os.path.join(BENCH_DIR, f"power_{args.days}d.db")
+    if args.regenerate or not is_current(source):
+        if os.path.exists(source):
+            os.remove(source)
+        generate_db(source, args.days)
+
+    work = os.path.join(BENCH_DIR, "run.db")
+    shutil.copyfile(source, work)
+    try:
+        output = {
+            "meta": metadata(source, args.days),
+            "results": run_benchmarks(work, args.repeat, sizes),
+        }
+    finally:
+        db_helper.close_db_connection()
+        for path in (work, work + "-wal", work + "-shm", os.path.join(BENCH_DIR, "summary.snap")):
+            if os.path.exists(path):
+                os.remove(path)
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+    elif not args.compare:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if not compare(output["results"], baseline["results"], args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
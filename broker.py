@@ -0,0 +1,67 @@
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def encode_event(event: str, data, event_id: Optional[str] = None) -> bytes:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+KEEPALIVE = b": keepalive\n\n"
+
+class Broker:
+    """
+    Fans Server-Sent Events out to connected clients. Every event is encoded
+    once and the same bytes are queued for every client; a client that falls
+    more than `backlog` events behind loses its oldest ones. The last
+    `history` events are kept so a reconnecting client can resume from its
+    Last-Event-ID. Event ids are snapshot timestamps, so they sort as strings.
+    """
+    def __init__(self, backlog: int = 32, history: int = 144):
+        self.backlog = backlog
+        self.history = deque(maxlen=history)
+        self.clients = set()
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, event_id: str, data: Dict):
+        message = encode_event("snapshot", data, event_id)
+        self.history.append((event_id, message))
+        self.published += 1
+        for queue in self.clients:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(message)
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.backlog)
+        if last_event_id:
+            missed = [message for event_id, message in self.history if event_id > last_event_id]
+            if len(missed) > self.backlog or (self.history and last_event_id < self.history[0][0]):
+                # Too far behind to replay, the client reloads the summary instead
+                queue.put_nowait(encode_event("resync", {"since": last_event_id}))
+            else:
+                for message in missed:
+                    queue.put_nowait(message)
+        self.clients.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.clients.discard(queue)
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.clients),
+            "history": len(self.history),
+            "last_event_id": self.history[-1][0] if self.history else None,
+            "published": self.published,
+            "dropped": self.dropped,
+        }
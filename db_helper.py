@@ -1,35 +1,337 @@
 import os
 import sqlite3
-from datetime import datetime
-from typing import Optional, List, Dict
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Iterable, Iterator, Tuple
+
+DB_PATH = os.environ.get("POWER_DB_PATH", os.path.join("data", "power.db"))
+
+# Applied to every connection. WAL lets readers run while the ingest writer
+# commits, NORMAL sync is durable enough under WAL and saves an fsync per commit.
+# auto_vacuum only takes effect before the first table is created, and setting
+# journal_mode already writes the file, so it goes first; on an existing
+# database it changes nothing (see retention.py --convert).
+DB_PRAGMAS = (
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16384",      # 16 MiB page cache
+    "PRAGMA mmap_size = 268435456",    # 256 MiB
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+_local = threading.local()
+
+POWER_GEN_TYPES = [
+    "nuclear",
+    "coal",
+    "cogen",
+    "ippcoal",
+    "lng",
+    "ipplng",
+    "oil",
+    "diesel",
+    "hydro",
+    "wind",
+    "solar",
+    "OtherRenewableEnergy",
+    "EnergyStorageSystem",
+    "EnergyStorageSystemLoad",
+]
+
+SUMMARY_COLUMNS = ", ".join(POWER_GEN_TYPES)
+
+# Rollup level -> (table, length of the timestamp prefix that forms its bucket)
+ROLLUP_TABLES = {
+    "hour":  ("summary_hourly", 13),   # 2024-05-01T13
+    "day":   ("summary_daily", 10),    # 2024-05-01
+    "month": ("summary_monthly", 7),   # 2024-05
+}
+
+ROLLUP_TYPES = POWER_GEN_TYPES + ["total"]
+
+# Per plant statistics of rows past the retention window, see retention.py
+PLANT_ROLLUP_TABLES = {
+    "hour": ("plant_hourly", 13),
+    "day":  ("plant_daily", 10),
+}
+
+# plant_data stores timestamps as whole minutes since 1970-01-01, the naive
+# local time of the snapshot; everything above db_helper keeps ISO strings.
+EPOCH = datetime(1970, 1, 1)
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+TIMESTAMP_PADDING = "0000-01-01T00:00:00"
+SQL_TIMESTAMP = f"strftime('{TIMESTAMP_FORMAT}', d.ts * 60, 'unixepoch')"
+
+# Rows in the shape of the original power_data table
+RECORD_COLUMNS = f'''
+    p.name, p.type, {SQL_TIMESTAMP} AS timestamp, p.is_sum,
+    d.capacity, d.capacity_percentage, d.generation, d.generation_percentage,
+    NULL AS created_at
+'''
+RECORD_FROM = "plant_data d JOIN plants p ON p.id = d.plant_id"
+
+# Pivots the is_sum rows of plant_data into one summary_by_timestamp row per timestamp
+SUMMARY_PIVOT = f'''
+    SELECT {SQL_TIMESTAMP},
+        {", ".join(f"MAX(CASE WHEN p.type = '{t}' THEN d.generation END)" for t in POWER_GEN_TYPES)},
+        SUM(d.generation)
+    FROM {RECORD_FROM}
+'''
+
+def to_minutes(timestamp: str) -> int:
+    """
+    Minutes since EPOCH of an ISO timestamp. A prefix such as "2024-05-01"
+    or "2024-05-01T13" stands for the first minute it covers.
+    """
+    dt = datetime.fromisoformat(timestamp + TIMESTAMP_PADDING[len(timestamp):])
+    if dt.tzinfo is not None:
+        raise ValueError(f"Timestamp with a time zone: {timestamp}")
+    return _datetime_minutes(dt)
+
+def _datetime_minutes(dt: datetime) -> int:
+    return int((dt - EPOCH).total_seconds()) // 60
+
+def from_minutes(minutes: int) -> str:
+    return (EPOCH + timedelta(minutes=minutes)).strftime(TIMESTAMP_FORMAT)
+
+def _minute_range(start: str, end: str) -> Tuple[int, int]:
+    """
+    Inclusive minute bounds matching `timestamp BETWEEN start AND end` on ISO
+    strings, where a prefix as the end bound sorts before every timestamp it covers.
+    """
+    last = to_minutes(end)
+    if len(end) < len(TIMESTAMP_PADDING):
+        last -= 1
+    return to_minutes(start), last
+
+def _half_open_range(start: str, end: str) -> Tuple[int, int]:
+    """
+    Minute bounds first <= minute < last of the rows in [start, end). Rows sit
+    on whole minutes, so a bound with seconds moves up to the next minute.
+    """
+    def ceil(timestamp: str) -> int:
+        dt = datetime.fromisoformat(timestamp + TIMESTAMP_PADDING[len(timestamp):])
+        return to_minutes(timestamp) + (1 if dt.second or dt.microsecond else 0)
+    return ceil(start), ceil(end)
+
+# Minutes of 1000-01-01 and 10000-01-01, between them timestamps sort as strings and as times alike
+_FIRST_MINUTE = to_minutes("1000-01-01")
+_END_MINUTE = to_minutes("9999-12-31T23:59") + 1
+
+def _ceil_minutes(text: str) -> int:
+    """First minute whose ISO timestamp sorts at or after text, for any string."""
+    low, high = _FIRST_MINUTE, _END_MINUTE
+    while low < high:
+        middle = (low + high) // 2
+        if from_minutes(middle) < text:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+def _prefix_range(prefix: str) -> Tuple[int, int]:
+    """
+    Inclusive minute bounds matching `timestamp LIKE prefix || '%'`, also for
+    a prefix that ends inside a field: "2024-05-1" covers the 10th to the 19th.
+    """
+    if not prefix:
+        return _FIRST_MINUTE, _END_MINUTE - 1
+    after = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return _ceil_minutes(prefix), _ceil_minutes(after) - 1
 
 # Database setup
-def get_db_connection():
-    conn = sqlite3.connect(os.path.join("data", "power.db"))
+def connect(path: Optional[str] = None, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or DB_PATH, cached_statements=256, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row  # Enable column access by name
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+def get_db_connection():
+    """
+    Returns the calling thread's connection, opening it on first use.
+    sqlite3 connections are bound to their thread, so every event loop,
+    render and ingest thread keeps one open instead of reconnecting per query.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect()
+    return conn
+
+def close_db_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
 def init_db():
     with get_db_connection() as conn:
+        # Every plant name and type is stored once, plant_data refers to it by id
         conn.execute('''
-            CREATE TABLE IF NOT EXISTS power_data (
+            CREATE TABLE IF NOT EXISTS plants (
+                id INTEGER PRIMARY KEY,
                 name TEXT NOT NULL,
                 type TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
                 is_sum BOOLEAN NOT NULL,
+                UNIQUE (name, type)
+            )
+        ''')
+        # One row per plant and snapshot, clustered by time so a range scan
+        # reads consecutive pages
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS plant_data (
+                ts INTEGER NOT NULL,
+                plant_id INTEGER NOT NULL,
                 capacity REAL,
                 capacity_percentage REAL,
                 generation REAL,
                 generation_percentage REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (name, type, timestamp)
-            )
+                PRIMARY KEY (ts, plant_id)
+            ) WITHOUT ROWID
         ''')
-        # Create additional indexes for better query performance
-        conn.execute('''
-            CREATE INDEX IF NOT EXISTS idx_timestamp
-            ON power_data(timestamp)
+        # Generation of every type at one timestamp, kept in step with power_data
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS summary_by_timestamp (
+                timestamp TEXT PRIMARY KEY,
+                {", ".join(f"{t} REAL" for t in POWER_GEN_TYPES)},
+                total REAL
+            ) WITHOUT ROWID
         ''')
+        migrate_summary_table(conn)
+        # Per type generation statistics, each level built from the one below
+        for table, _ in ROLLUP_TABLES.values():
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    samples INTEGER NOT NULL,
+                    sum_generation REAL,
+                    min_generation REAL,
+                    max_generation REAL,
+                    PRIMARY KEY (bucket, type)
+                ) WITHOUT ROWID
+            ''')
+        migrate_rollup_tables(conn)
+        for table, _ in PLANT_ROLLUP_TABLES.values():
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TEXT NOT NULL,
+                    plant_id INTEGER NOT NULL,
+                    samples INTEGER NOT NULL,
+                    sum_generation REAL,
+                    min_generation REAL,
+                    max_generation REAL,
+                    PRIMARY KEY (bucket, plant_id)
+                ) WITHOUT ROWID
+            ''')
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'power_data'").fetchone():
+            print("Found power_data from the previous schema, the server copies it into plant_data in the background")
+
+def migrate_summary_table(conn: sqlite3.Connection):
+    """One-off backfill of summary_by_timestamp from the rows stored before it existed."""
+    if conn.execute("SELECT 1 FROM summary_by_timestamp LIMIT 1").fetchone():
+        return
+    conn.execute(f'''
+        INSERT OR IGNORE INTO summary_by_timestamp (timestamp, {SUMMARY_COLUMNS}, total)
+        {SUMMARY_PIVOT}
+        WHERE p.is_sum = 1
+        GROUP BY d.ts
+    ''')
+
+def _rollup_sql(level: str, where: str = "") -> str:
+    table, length = ROLLUP_TABLES[level]
+    columns = "bucket, type, samples, sum_generation, min_generation, max_generation"
+    if level == "hour":
+        # Unpivot the wide summary rows, one SELECT per type
+        selects = " UNION ALL ".join(f'''
+            SELECT substr(timestamp, 1, {length}) AS bucket, '{t}' AS type,
+                COUNT({t}) AS samples, SUM({t}), MIN({t}), MAX({t})
+            FROM summary_by_timestamp {where.format(column="timestamp")}
+            GROUP BY bucket
+        ''' for t in ROLLUP_TYPES)
+        return f"INSERT INTO {table} ({columns}) SELECT * FROM ({selects}) WHERE samples > 0"
+
+    levels = list(ROLLUP_TABLES)
+    lower, _ = ROLLUP_TABLES[levels[levels.index(level) - 1]]
+    return f'''
+        INSERT INTO {table} ({columns})
+        SELECT substr(bucket, 1, {length}) AS rollup_bucket, type,
+            SUM(samples), SUM(sum_generation), MIN(min_generation), MAX(max_generation)
+        FROM {lower} {where.format(column="bucket")}
+        GROUP BY rollup_bucket, type
+    '''
+
+def migrate_rollup_tables(conn: sqlite3.Connection):
+    """One-off build of the rollup tables from summary_by_timestamp."""
+    table, _ = ROLLUP_TABLES["hour"]
+    if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+        return
+    for level in ROLLUP_TABLES:
+        conn.execute(_rollup_sql(level))
+
+def _refresh_rollups(conn: sqlite3.Connection, timestamps: List[str]):
+    # Rebuilding only the buckets holding these timestamps keeps this cheap:
+    # an hour holds 6 snapshots, a day 24 hours and a month ~30 days.
+    for level, (table, length) in ROLLUP_TABLES.items():
+        buckets = [(bucket, ) for bucket in sorted({timestamp[:length] for timestamp in timestamps})]
+        conn.executemany(f"DELETE FROM {table} WHERE bucket = ?", buckets)
+        conn.executemany(
+            _rollup_sql(level, "WHERE {column} >= ?1 AND {column} < ?1 || '~'"),
+            buckets)
+
+def _refresh_summary(conn: sqlite3.Connection, timestamps: Iterable[str]):
+    timestamps = list(timestamps)
+    conn.executemany('''
+        DELETE FROM summary_by_timestamp WHERE timestamp = ?
+    ''', [(timestamp, ) for timestamp in timestamps])
+    conn.executemany(f'''
+        INSERT INTO summary_by_timestamp (timestamp, {SUMMARY_COLUMNS}, total)
+        {SUMMARY_PIVOT}
+        WHERE d.ts = ? AND p.is_sum = 1
+        GROUP BY d.ts
+    ''', [(to_minutes(timestamp), ) for timestamp in timestamps])
+    _refresh_rollups(conn, timestamps)
+
+def rollup_plant_rows(conn: sqlite3.Connection, first: int, last: int) -> Tuple[int, int]:
+    """
+    Folds the per-plant (is_sum = 0) rows with first <= ts < last into
+    PLANT_ROLLUP_TABLES and deletes them, in one transaction. Buckets already
+    present are merged, so a day can be folded an hour at a time.
+    Returns (aggregate rows written, plant rows deleted).
+    """
+    with conn:
+        written = 0
+        for table, length in PLANT_ROLLUP_TABLES.values():
+            cursor = conn.execute(f'''
+                INSERT INTO {table} (bucket, plant_id, samples, sum_generation, min_generation, max_generation)
+                SELECT substr({SQL_TIMESTAMP}, 1, {length}) AS rollup_bucket, d.plant_id,
+                    COUNT(d.generation), SUM(d.generation), MIN(d.generation), MAX(d.generation)
+                FROM {RECORD_FROM}
+                WHERE d.ts >= ? AND d.ts < ? AND p.is_sum = 0
+                GROUP BY rollup_bucket, d.plant_id
+                ON CONFLICT(bucket, plant_id) DO UPDATE SET
+                    samples = samples + excluded.samples,
+                    sum_generation = IFNULL(sum_generation + excluded.sum_generation, IFNULL(sum_generation, excluded.sum_generation)),
+                    min_generation = MIN(IFNULL(min_generation, excluded.min_generation), IFNULL(excluded.min_generation, min_generation)),
+                    max_generation = MAX(IFNULL(max_generation, excluded.max_generation), IFNULL(excluded.max_generation, max_generation))
+            ''', (first, last))
+            written += cursor.rowcount
+        cursor = conn.execute('''
+            DELETE FROM plant_data
+            WHERE ts >= ? AND ts < ? AND plant_id IN (SELECT id FROM plants WHERE is_sum = 0)
+        ''', (first, last))
+        return written, cursor.rowcount
+
+def get_oldest_plant_minute(after: int = -1) -> Optional[int]:
+    """ts of the oldest per-plant row after `after`, in minutes."""
+    with get_db_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT MIN(d.ts) AS ts FROM {RECORD_FROM}
+            WHERE d.ts > ? AND p.is_sum = 0
+        ''', (after, ))
+        return cursor.fetchone()["ts"]
 
 # Data model
 class PowerGenerationRecord:
@@ -55,44 +357,83 @@ class PowerGenerationRecord:
 
 # CRUD Operations
 def insert_record(record: PowerGenerationRecord) -> bool:
-    try:
-        with get_db_connection() as conn:
-            conn.execute('''
-                INSERT INTO power_data (
-                    name, type, timestamp, is_sum,
-                    capacity, capacity_percentage,
-                    generation, generation_percentage
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                record.name, record.type, record.timestamp, record.is_sum,
-                record.capacity, record.capacity_percentage,
-                record.generation, record.generation_percentage
-            ))
-        return True
-    except sqlite3.IntegrityError:
-        # print("Record already exists (duplicate primary key)")
-        return False
+    inserted, _ = insert_records([record])
+    return inserted > 0
+
+def _plant_ids(conn: sqlite3.Connection, records: List[PowerGenerationRecord], update: bool = False) -> Dict[Tuple[str, str], int]:
+    """Adds the plants of these records to the plants table, returns (name, type) -> id."""
+    conflict = "DO UPDATE SET is_sum = excluded.is_sum" if update else "DO NOTHING"
+    conn.executemany(f'''
+        INSERT INTO plants (name, type, is_sum) VALUES (?, ?, ?)
+        ON CONFLICT(name, type) {conflict}
+    ''', [(record.name, record.type, record.is_sum) for record in records])
+    cursor = conn.execute("SELECT id, name, type FROM plants")
+    return {(row["name"], row["type"]): row["id"] for row in cursor}
+
+def _record_params(records: Iterable[PowerGenerationRecord], plant_ids: Dict[Tuple[str, str], int]):
+    minutes = {}
+    for record in records:
+        if record.timestamp not in minutes:
+            minutes[record.timestamp] = to_minutes(record.timestamp)
+        yield (
+            minutes[record.timestamp], plant_ids[record.name, record.type],
+            record.capacity, record.capacity_percentage,
+            record.generation, record.generation_percentage
+        )
+
+def _plant_id(conn: sqlite3.Connection, name: str, type: str) -> Optional[int]:
+    row = conn.execute("SELECT id FROM plants WHERE name = ? AND type = ?", (name, type)).fetchone()
+    return row["id"] if row else None
+
+def _sum_timestamps(records: List[PowerGenerationRecord]) -> List[str]:
+    return sorted({record.timestamp for record in records if record.is_sum})
+
+def insert_records(records: Iterable[PowerGenerationRecord]) -> Tuple[int, int]:
+    """
+    Inserts a whole snapshot in one transaction, skipping rows that already exist.
+    Returns (inserted, duplicates).
+    """
+    records = list(records)
+    with get_db_connection() as conn:
+        params = list(_record_params(records, _plant_ids(conn, records)))
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT OR IGNORE INTO plant_data (
+                ts, plant_id,
+                capacity, capacity_percentage,
+                generation, generation_percentage
+            ) VALUES (?, ?, ?, ?, ?, ?)
+        ''', params)
+        inserted = conn.total_changes - before
+        if inserted:
+            _refresh_summary(conn, _sum_timestamps(records))
+    return inserted, len(params) - inserted
+
+def upsert_records(records: Iterable[PowerGenerationRecord]) -> int:
+    """Inserts or updates a whole snapshot in one transaction. Returns rows written."""
+    records = list(records)
+    with get_db_connection() as conn:
+        plant_ids = _plant_ids(conn, records, update=True)
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT INTO plant_data (
+                ts, plant_id,
+                capacity, capacity_percentage,
+                generation, generation_percentage
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(ts, plant_id) DO UPDATE SET
+                capacity = excluded.capacity,
+                capacity_percentage = excluded.capacity_percentage,
+                generation = excluded.generation,
+                generation_percentage = excluded.generation_percentage
+        ''', _record_params(records, plant_ids))
+        written = conn.total_changes - before
+        _refresh_summary(conn, _sum_timestamps(records))
+        return written
 
 def upsert_record(record: PowerGenerationRecord) -> bool:
     try:
-        with get_db_connection() as conn:
-            conn.execute('''
-                INSERT INTO power_data (
-                    name, type, timestamp, is_sum,
-                    capacity, capacity_percentage,
-                    generation, generation_percentage
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(name, type, timestamp) DO UPDATE SET
-                    is_sum = excluded.is_sum,
-                    capacity = excluded.capacity,
-                    capacity_percentage = excluded.capacity_percentage,
-                    generation = excluded.generation,
-                    generation_percentage = excluded.generation_percentage
-            ''', (
-                record.name, record.type, record.timestamp, record.is_sum,
-                record.capacity, record.capacity_percentage,
-                record.generation, record.generation_percentage
-            ))
+        upsert_records([record])
         return True
     except sqlite3.Error as e:
         print(f"Database error: {e}")
@@ -100,73 +441,193 @@ def upsert_record(record: PowerGenerationRecord) -> bool:
 
 def get_record(name: str, type: str, timestamp: str) -> Optional[Dict]:
     with get_db_connection() as conn:
-        cursor = conn.execute('''
-            SELECT * FROM power_data
-            WHERE name = ? AND type = ? AND timestamp = ?
-        ''', (name, type, timestamp))
+        cursor = conn.execute(f'''
+            SELECT {RECORD_COLUMNS} FROM {RECORD_FROM}
+            WHERE p.name = ? AND p.type = ? AND d.ts = ?
+        ''', (name, type, to_minutes(timestamp)))
         return dict(cursor.fetchone()) if cursor.fetchone() else None
 
 def get_records_by_time_range(start: str, end: str) -> List[Dict]:
     with get_db_connection() as conn:
-        cursor = conn.execute('''
-            SELECT * FROM power_data
-            WHERE timestamp BETWEEN ? AND ?
-            ORDER BY timestamp
-        ''', (start, end))
+        cursor = conn.execute(f'''
+            SELECT {RECORD_COLUMNS} FROM {RECORD_FROM}
+            WHERE d.ts BETWEEN ? AND ?
+            ORDER BY d.ts
+        ''', _minute_range(start, end))
         return [dict(row) for row in cursor.fetchall()]
 
+# Columns of iter_records rows, in order
+EXPORT_COLUMNS = [
+    "timestamp", "name", "type", "is_sum",
+    "capacity", "capacity_percentage", "generation", "generation_percentage",
+]
+
+def iter_records(conn: sqlite3.Connection, start: str, end: str, type: Optional[str] = None,
+                 name: Optional[str] = None, chunk_size: int = 1000) -> Iterator[List[sqlite3.Row]]:
+    """
+    Plant rows between start and end in chunks of chunk_size, ordered by time.
+    Only one chunk is held at a time, so memory does not grow with the range.
+    conn should be a connection of its own, the cursor stays open between chunks.
+    """
+    where = ["d.ts BETWEEN ? AND ?"]
+    params = list(_minute_range(start, end))
+    if type is not None:
+        where.append("p.type = ?")
+        params.append(type)
+    if name is not None:
+        where.append("p.name = ?")
+        params.append(name)
+    cursor = conn.execute(f'''
+        SELECT {SQL_TIMESTAMP} AS timestamp, p.name, p.type, p.is_sum,
+            d.capacity, d.capacity_percentage, d.generation, d.generation_percentage
+        FROM {RECORD_FROM}
+        WHERE {" AND ".join(where)}
+        ORDER BY d.ts, d.plant_id
+    ''', params)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
 def get_sum_records_by_time_range(start: str, end: str) -> List[Dict]:
     with get_db_connection() as conn:
-        cursor = conn.execute('''
-            SELECT * FROM power_data
-            WHERE timestamp BETWEEN ? AND ? AND is_sum = 1
+        cursor = conn.execute(f'''
+            SELECT {RECORD_COLUMNS} FROM {RECORD_FROM}
+            WHERE d.ts BETWEEN ? AND ? AND p.is_sum = 1
+            ORDER BY d.ts
+        ''', _minute_range(start, end))
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_summary_by_time_range(start: str, end: str) -> List[Dict]:
+    """
+    One row per timestamp with a column per POWER_GEN_TYPES entry plus total,
+    for start <= timestamp < end; a date as end is the midnight that ends the day before.
+    """
+    first, last = _half_open_range(start, end)
+    with get_db_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT timestamp, {SUMMARY_COLUMNS}, total
+            FROM summary_by_timestamp
+            WHERE timestamp >= ? AND timestamp < ?
             ORDER BY timestamp
-        ''', (start, end))
+        ''', (from_minutes(first), from_minutes(last)))
+        return [dict(row) for row in cursor.fetchall()]
+
+def summary_rows_to_dict(rows: Iterable[Dict]) -> Dict[str, Dict[str, float]]:
+    """Summary rows as {timestamp: {type: generation}}, the shape /api/summary.json and the plots use."""
+    return {
+        row["timestamp"]: {t: row[t] for t in POWER_GEN_TYPES if row[t] is not None}
+        for row in rows
+    }
+
+def get_summary_since(since: str) -> List[Dict]:
+    """Like get_summary_by_time_range, for every timestamp strictly after since."""
+    with get_db_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT timestamp, {SUMMARY_COLUMNS}, total
+            FROM summary_by_timestamp
+            WHERE timestamp > ?
+            ORDER BY timestamp
+        ''', (since, ))
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_rollup_by_time_range(level: str, start: str, end: str) -> List[Dict]:
+    """
+    Generation statistics per bucket and type, level is one of ROLLUP_TABLES.
+    Every bucket holding a minute of [start, end) is included, the same rows
+    as get_summary_by_time_range covers.
+    """
+    table, length = ROLLUP_TABLES[level]
+    first, last = _half_open_range(start, end)
+    if first >= last:
+        return []
+    with get_db_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT bucket, type, samples,
+                sum_generation / samples AS avg_generation,
+                min_generation, max_generation
+            FROM {table}
+            WHERE bucket BETWEEN ? AND ?
+            ORDER BY bucket
+        ''', (from_minutes(first)[:length], from_minutes(last - 1)[:length]))
         return [dict(row) for row in cursor.fetchall()]
 
 def get_sum_records_by_time(time: str) -> List[Dict]:
     with get_db_connection() as conn:
-        cursor = conn.execute('''
-            SELECT * FROM power_data
-            WHERE timestamp = ? AND is_sum = 1
-        ''', (time, ))
+        cursor = conn.execute(f'''
+            SELECT {RECORD_COLUMNS} FROM {RECORD_FROM}
+            WHERE d.ts = ? AND p.is_sum = 1
+        ''', (to_minutes(time), ))
         return [dict(row) for row in cursor.fetchall()]
 
 def get_aggregated_generation_by_type(date: str) -> List[Dict]:
+    first, last = _prefix_range(date)
+    # Rows past retention only survive in the plant rollups, a day or
+    # longer prefix is answered from plant_daily, a shorter one from
+    # plant_hourly; a prefix within an hour gets the whole folded hour
+    level = "day" if len(date) <= 10 else "hour"
+    table, length = PLANT_ROLLUP_TABLES[level]
+    buckets = (from_minutes(first)[:length], from_minutes(last)[:length])
     with get_db_connection() as conn:
-        cursor = conn.execute('''
+        cursor = conn.execute(f'''
             SELECT type, SUM(generation) as total_generation
-            FROM power_data
-            WHERE timestamp LIKE ? || '%' AND is_sum = 0
+            FROM (
+                SELECT p.type, d.generation
+                FROM {RECORD_FROM}
+                WHERE d.ts BETWEEN ? AND ? AND p.is_sum = 0
+                UNION ALL
+                SELECT p.type, r.sum_generation
+                FROM {table} r JOIN plants p ON p.id = r.plant_id
+                WHERE r.bucket BETWEEN ? AND ? AND p.is_sum = 0
+            )
             GROUP BY type
-        ''', (date,))
+        ''', (first, last, *buckets))
         return [dict(row) for row in cursor.fetchall()]
 
 def delete_record(name: str, type: str, timestamp: str) -> bool:
     with get_db_connection() as conn:
         cursor = conn.execute('''
-            DELETE FROM power_data
-            WHERE name = ? AND type = ? AND timestamp = ?
-        ''', (name, type, timestamp))
+            DELETE FROM plant_data
+            WHERE ts = ? AND plant_id = ?
+        ''', (to_minutes(timestamp), _plant_id(conn, name, type)))
+        if cursor.rowcount > 0:
+            _refresh_summary(conn, [timestamp])
         return cursor.rowcount > 0
 
 def get_latest_summary_record() -> List[Dict]:
     with get_db_connection() as conn:
-        cursor = conn.execute('''
+        # summary_by_timestamp only holds timestamps that have is_sum rows
+        cursor = conn.execute(f'''
             WITH latest AS (
-                SELECT timestamp 
-                FROM power_data
-                WHERE is_sum = 1
-                ORDER BY timestamp DESC
-                LIMIT 1
+                SELECT MAX(timestamp) AS timestamp
+                FROM summary_by_timestamp
             )
-            SELECT p.*
-            FROM power_data p
-            JOIN latest l ON p.timestamp = l.timestamp
+            SELECT {RECORD_COLUMNS}
+            FROM {RECORD_FROM}
+            JOIN latest l ON d.ts = CAST(strftime('%s', l.timestamp) AS INTEGER) / 60
             WHERE p.is_sum = 1
         ''')
         return [dict(row) for row in cursor.fetchall()]
 
+def has_snapshot(timestamp: str) -> bool:
+    with get_db_connection() as conn:
+        cursor = conn.execute('''
+            SELECT 1 FROM summary_by_timestamp
+            WHERE timestamp = ?
+        ''', (timestamp, ))
+        return cursor.fetchone() is not None
+
+def get_latest_timestamp() -> Optional[str]:
+    with get_db_connection() as conn:
+        cursor = conn.execute('''
+            SELECT MAX(timestamp) AS timestamp FROM summary_by_timestamp
+        ''')
+        return cursor.fetchone()["timestamp"]
+
 # Example usage
 if __name__ == "__main__":
     # Initialize database
@@ -1,9 +1,15 @@
 import cairo
 from datetime import datetime, timedelta
-from typing import Dict, Any, TypedDict
+from typing import Dict, Any
+import io
 import os
+import sys
 import math
+import threading
+from collections import OrderedDict
 from enum import IntEnum
+from functools import lru_cache
+import numpy as np
 
 class PlotType(IntEnum):
     SHOW_ALL = 0
@@ -31,6 +37,14 @@ POWER_TYPE = {
     "ENERGY_STORAGE":    "EnergyStorageSystem",
 }
 
+CONFIG_MARGIN_TOP = 25
+CONFIG_MARGIN_RIGHT = 24
+CONFIG_MARGIN_BOTTOM = 20
+CONFIG_MARGIN_LEFT = 10
+
+# Recorded chart chromes kept, one per size / plot type / dithering / time axis
+CHROME_CACHE_SIZE = int(os.environ.get("CHROME_CACHE_SIZE", 64))
+
 GRAY_COLORS = [
     "#222222",
     "#444444",
@@ -42,36 +56,84 @@ GRAY_COLORS = [
 ]
 
 
-class PowerData(TypedDict):
-    nuclear: float
-    coal: float
-    cogen: float
-    ippcoal: float
-    lng: float
-    ipplng: float
-    oil: float
-    diesel: float
-    hydro: float
-    wind: float
-    solar: float
-    OtherRenewableEnergy: float
-    EnergyStorageSystem: float
-
-def sum_power_data(data: PowerData) -> float:
-    return data["nuclear"] + \
-           data["coal"] + \
-           data["cogen"] + \
-           data["ippcoal"] + \
-           data["lng"] + \
-           data["ipplng"] + \
-           data["oil"] + \
-           data["diesel"] + \
-           data["hydro"] + \
-           data["wind"] + \
-           data["solar"] + \
-           data["OtherRenewableEnergy"] + \
-           data["EnergyStorageSystem"]
+def get_time_slot(now: datetime = None) -> datetime:
+    """Start of the 10 minute slot the time axis currently ends in, the plot is the same within one."""
+    now = now or datetime.now()
+    return now.replace(minute=now.minute - now.minute % 10, second=0, microsecond=0)
+
+# Columns of the generation matrix, in POWER_TYPE order
+POWER_TYPE_COLUMNS = list(POWER_TYPE.values())
+
+# Stacked layers of every plot type, bottom layer first
+PLOT_GROUPS = {
+    PlotType.SHOW_ALL: [
+        ["coal", "ippcoal", "cogen"],
+        ["lng", "ipplng"],
+        ["oil", "diesel"],
+        ["hydro"],
+        ["wind"],
+        ["solar"],
+        ["nuclear", "OtherRenewableEnergy", "EnergyStorageSystem"],
+    ],
+    PlotType.SOLAR_AND_OTHER: [
+        [k for k in POWER_TYPE_COLUMNS if k != "solar"],
+        ["solar"],
+    ],
+    PlotType.RENEWABLE_AND_OTHER: [
+        ["coal", "ippcoal", "cogen", "lng", "ipplng", "oil", "diesel"],
+        ["solar", "hydro", "wind", "nuclear", "OtherRenewableEnergy", "EnergyStorageSystem"],
+    ],
+    PlotType.LNG_COAL_AND_OTHER: [
+        ["coal", "ippcoal", "cogen"],
+        ["lng", "ipplng", "oil", "diesel"],
+        ["solar", "hydro", "wind", "nuclear", "OtherRenewableEnergy", "EnergyStorageSystem"],
+    ],
+}
 
+# (POWER_TYPE_COLUMNS x layers) 0/1 matrices, topmost layer first as drawn
+GROUPING_MATRICES = {
+    plot_type: np.array([
+        [1.0 if k in group else 0.0 for group in reversed(groups)]
+        for k in POWER_TYPE_COLUMNS
+    ])
+    for plot_type, groups in PLOT_GROUPS.items()
+}
+
+def build_generation_matrix(data, time_intervals) -> np.ndarray:
+    """
+    Dense (intervals x POWER_TYPE_COLUMNS) generation. An interval without data
+    takes the mean of the nearest intervals with data on either side, or zeros
+    when there is none on one side.
+    """
+    n = len(time_intervals)
+    matrix = np.zeros((n, len(POWER_TYPE_COLUMNS)))
+    present = np.zeros(n, dtype=bool)
+    for idx, time in enumerate(time_intervals):
+        row = data.get(time)
+        if row is not None:
+            present[idx] = True
+            matrix[idx] = [row.get(k, 0) for k in POWER_TYPE_COLUMNS]
+
+    positions = np.arange(n)
+    prev_idx = np.maximum.accumulate(np.where(present, positions, -1))
+    next_idx = np.minimum.accumulate(np.where(present, positions, n)[::-1])[::-1]
+    gaps = ~present & (prev_idx >= 0) & (next_idx < n)
+    matrix[gaps] = (matrix[prev_idx[gaps]] + matrix[next_idx[gaps]]) / 2
+    return matrix
+
+def build_stack(matrix: np.ndarray, plot_type: PlotType, chart_height: float, value_scale: float) -> np.ndarray:
+    """
+    Y coordinates of the stacked layers, (intervals x layers + 1). Column 0 is
+    the top of the stack and column i + 1 the bottom edge of layer i.
+    """
+    # Column by column in POWER_TYPE order, a plain left to right sum per
+    # interval rather than NumPy's pairwise summation
+    total = matrix[:, 0].copy()
+    for column in range(1, matrix.shape[1]):
+        total += matrix[:, column]
+
+    heights = (matrix @ GROUPING_MATRICES[plot_type]) * value_scale
+    return np.cumsum(np.column_stack([chart_height - total * value_scale, heights]), axis=1)
 
 def generate_time_intervals() -> list[str]:
     now = datetime.now()
@@ -122,13 +184,27 @@ def get_pat_path(idx):
     pattern_base_path = os.path.join("www", "img")
     return os.path.join(pattern_base_path, f"gray-{idx}.png")
 
+@lru_cache(maxsize=None)
+def load_pattern_pixels(pattern_path):
+    """Decoded pattern tiles are kept for the life of the process, as plain bytes."""
+    surface = cairo.ImageSurface.create_from_png(pattern_path)
+    surface.flush()
+    return (surface.get_format(), surface.get_width(), surface.get_height(),
+            surface.get_stride(), bytes(surface.get_data()))
+
+def load_pattern_surface(pattern_path):
+    # A surface of its own per call: renders run on several threads at once
+    # and a cairo surface must not be used by two of them without a lock
+    format, width, height, stride, pixels = load_pattern_pixels(pattern_path)
+    return cairo.ImageSurface.create_for_data(bytearray(pixels), format, width, height, stride)
+
 def get_pattern(dithering, generation_pattern, idx):
     if dithering == DitheringType.NONE:
         pattern = hex_to_pattern(GRAY_COLORS[generation_pattern[idx] - 1])
     else:
         pattern_path = get_pat_path(generation_pattern[idx])
         try:
-            surface = cairo.ImageSurface.create_from_png(pattern_path)
+            surface = load_pattern_surface(pattern_path)
             pattern = cairo.SurfacePattern(surface)
             pattern.set_extend(cairo.Extend.REPEAT)
         except:
@@ -136,28 +212,106 @@ def get_pattern(dithering, generation_pattern, idx):
             pattern = hex_to_pattern(GRAY_COLORS[generation_pattern[idx] - 1])
     return pattern
 
-def plot_generation(data, plot_type: PlotType, width: int, height: int, dithering: DitheringType) -> str:
-    config_margin_top = 25
-    config_margin_right = 24
-    config_margin_bottom = 20
-    config_margin_left = 10
-
-    container_width  = width
-    container_height = height
+def plot_generation(data, plot_type: PlotType, width: int, height: int, dithering: DitheringType) -> bytes:
+    """Renders the stacked generation chart and returns the SVG document."""
+    svg_buffer = io.BytesIO()
+    svg_surface = cairo.SVGSurface(svg_buffer, width, height)
+    draw_plot(cairo.Context(svg_surface), data, plot_type, width, height, dithering)
+    svg_surface.finish()
 
-    chart_width = container_width - config_margin_left - config_margin_right
-    chart_height = container_height - config_margin_top - config_margin_bottom
+    return svg_buffer.getvalue()
+
+def plot_generation_gray(data, plot_type: PlotType, width: int, height: int, dithering: DitheringType) -> np.ndarray:
+    """Rasterizes the chart, returns (height x width) luminance in 0..1."""
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.paint()
+    draw_plot(ctx, data, plot_type, width, height, dithering)
+    surface.flush()
+
+    # RGB24 pixels are native-endian 32-bit 0x00RRGGBB
+    pixels = np.ndarray(
+        shape=(height, surface.get_stride() // 4, 4),
+        dtype=np.uint8,
+        buffer=surface.get_data(),
+    )[:, :width]
+    if sys.byteorder == "little":
+        b, g, r = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    else:
+        r, g, b = pixels[..., 1], pixels[..., 2], pixels[..., 3]
+    return (0.299 * r + 0.587 * g + 0.114 * b) / 255
 
-    time_intervals = generate_time_intervals()
+def get_generation_legend(plot_type: PlotType):
+    """Names and gray pattern indices of the layers, in drawing order."""
+    # Set names and patterns based on plot type
+    if plot_type == PlotType.SHOW_ALL:
+        generation_name = ["燃煤", "燃氣", "燃油",
+                         "水力", "風力", "太陽能",
+                         "核能、其他再生、儲能"]
+        generation_pattern = [1, 2, 3, 4, 5, 6, 7]
+    elif plot_type == PlotType.SOLAR_AND_OTHER:
+        generation_name = ["其他", "太陽能"]
+        generation_pattern = [2, 6]
+    elif plot_type == PlotType.RENEWABLE_AND_OTHER:
+        generation_name = ["化石燃料", "再生能源"]
+        generation_pattern = [2, 6]
+    elif plot_type == PlotType.LNG_COAL_AND_OTHER:
+        generation_name = ["燃煤", "燃氣、燃油", "其他"]
+        generation_pattern = [1, 4, 6]
 
-    svg_path = os.path.join("www", f"plot_{width}x{height}.svg")
+    # Reverse to match drawing order
+    generation_name.reverse()
+    generation_pattern.reverse()
+    return generation_name, generation_pattern
 
-    svg_surface = cairo.SVGSurface(svg_path, container_width, container_height)
+class ChromeCache:
+    """
+    Recorded drawings of everything on a chart that does not depend on the
+    data: time grid and labels, unit label and legend. They only change with
+    the size, plot type, dithering and the 10 minute phase of the time axis.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        # Built outside the lock, two threads may both build a missing entry
+        entry = (build(), threading.Lock())
+        with self._lock:
+            entry = self._entries.setdefault(key, entry)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+chrome_cache = ChromeCache(CHROME_CACHE_SIZE)
+
+def record_chrome(plot_type: PlotType, width: int, height: int, dithering: DitheringType, time_intervals):
+    surface = cairo.RecordingSurface(cairo.Content.COLOR_ALPHA, cairo.Rectangle(0, 0, width, height))
+    ctx = cairo.Context(surface)
+    ctx.translate(CONFIG_MARGIN_LEFT, CONFIG_MARGIN_TOP)
+    draw_chrome(ctx, plot_type, width, height, dithering, time_intervals)
+    return surface
+
+def draw_plot(ctx, data, plot_type: PlotType, width: int, height: int, dithering: DitheringType):
+    container_width  = width
+    container_height = height
 
-    ctx = cairo.Context(svg_surface)
+    chart_width = container_width - CONFIG_MARGIN_LEFT - CONFIG_MARGIN_RIGHT
+    chart_height = container_height - CONFIG_MARGIN_TOP - CONFIG_MARGIN_BOTTOM
 
-    ctx.save()
-    ctx.translate(config_margin_left, config_margin_top)
+    time_intervals = generate_time_intervals()
 
     max_value = max(
         sum(data[interval].values()) if interval in data else 0
@@ -171,141 +325,24 @@ def plot_generation(data, plot_type: PlotType, width: int, height: int, ditherin
     bar_width = chart_width / len(time_intervals)
     value_scale = chart_height / max_axis_value
 
-    generation_path_top = []
-    generation_path_bot = []
-    generation_name    = None
-    generation_pattern = None
-    generation_time    = []
-
-    cnt = 0
-    if (plot_type == PlotType.SHOW_ALL):
-        cnt = 7
-    elif (plot_type == PlotType.SOLAR_AND_OTHER):
-        cnt = 2
-    elif (plot_type == PlotType.RENEWABLE_AND_OTHER):
-        cnt = 2
-    elif (plot_type == PlotType.LNG_COAL_AND_OTHER):
-        cnt = 3
-
-    for i in range(cnt):
-        generation_path_top.append([])
-        generation_path_bot.append([])
-
-    default_data: PowerData = {
-        "nuclear": 0,
-        "coal": 0,
-        "cogen": 0,
-        "ippcoal": 0,
-        "lng": 0,
-        "ipplng": 0,
-        "oil": 0,
-        "diesel": 0,
-        "hydro": 0,
-        "wind": 0,
-        "solar": 0,
-        "OtherRenewableEnergy": 0,
-        "EnergyStorageSystem": 0,
-    }
+    generation_name, generation_pattern = get_generation_legend(plot_type)
 
-    for idx, time in enumerate(time_intervals):
-        time_obj = datetime.fromisoformat(time.replace('Z', ''))
-        x = idx * bar_width
-        if time in data:
-            curr = default_data.copy()
-            curr.update({k: data[time][k] for k in data[time] if k in curr})
-            total_generation = sum_power_data(curr)
-            bar_height = total_generation * value_scale
-        else:
-            # Interpolate using previous and next available data
-            prev_idx = next((i for i in range(idx - 1, -1, -1) if time_intervals[i] in data), None)
-            next_idx = next((i for i in range(idx + 1, len(time_intervals)) if time_intervals[i] in data), None)
-            if prev_idx is not None and next_idx is not None:
-                prev_data = data[time_intervals[prev_idx]]
-                next_data = data[time_intervals[next_idx]]
-                # Linear interpolation for each key, fallback to 0 if missing
-                curr = default_data.copy()
-                for k in default_data.keys():
-                    prev_val = prev_data.get(k, 0)
-                    next_val = next_data.get(k, 0)
-                    curr[k] = (prev_val + next_val) / 2
-                total_generation = sum_power_data(curr)
-                bar_height = total_generation * value_scale
-            else:
-                bar_height = 0
-                total_generation = 0
-                curr = default_data.copy()
+    matrix = build_generation_matrix(data, time_intervals)
+    stack = build_stack(matrix, plot_type, chart_height, value_scale)
 
-        y = chart_height - bar_height
-
-        if time_obj.minute == 0 and time_obj.hour % 6 == 0:
-            formatted_time = time.replace('T', ' ')[5:16]
-            generation_time.append((x, formatted_time))
-
-        generation = []
-
-        if plot_type == PlotType.SHOW_ALL:
-            generation.extend([
-                curr["coal"] + curr["ippcoal"] + curr["cogen"],
-                curr["lng"] + curr["ipplng"],
-                curr["oil"] + curr["diesel"],
-                curr["hydro"],
-                curr["wind"],
-                curr["solar"],
-                curr["nuclear"] + curr["OtherRenewableEnergy"] + curr["EnergyStorageSystem"]
-            ])
-        elif plot_type == PlotType.SOLAR_AND_OTHER:
-            generation.extend([
-                sum_power_data(curr) - curr["solar"],
-                curr["solar"]
-            ])
-        elif plot_type == PlotType.RENEWABLE_AND_OTHER:
-            generation.extend([
-                curr["coal"] + curr["ippcoal"] + curr["cogen"] +
-                curr["lng"] + curr["ipplng"] + curr["oil"] + curr["diesel"],
-                curr["solar"] + curr["hydro"] + curr["wind"] +
-                curr["nuclear"] + curr["OtherRenewableEnergy"] + curr["EnergyStorageSystem"]
-            ])
-        elif plot_type == PlotType.LNG_COAL_AND_OTHER:
-            generation.extend([
-                curr["coal"] + curr["ippcoal"] + curr["cogen"],
-                curr["lng"] + curr["ipplng"] + curr["oil"] + curr["diesel"],
-                curr["solar"] + curr["hydro"] + curr["wind"] +
-                curr["nuclear"] + curr["OtherRenewableEnergy"] + curr["EnergyStorageSystem"]
-            ])
-        generation.reverse()
-
-        for i, value in enumerate(generation):
-            bar_height = value * value_scale
-            generation_path_top[i].extend([(x, y), (x + bar_width, y)])
-            generation_path_bot[i].extend([(x, y + bar_height), (x + bar_width, y + bar_height)])
-            y += bar_height
-
-
-    # Combine top and reversed bottom paths
+    # Each layer is its top edge left to right, then its bottom edge back
+    x = np.arange(len(time_intervals)) * bar_width
+    x_edges = np.column_stack([x, x + bar_width]).ravel()
+    path_x = np.concatenate([x_edges, x_edges[::-1]]).tolist()
     generation_path = []
-    for i in range(len(generation_path_bot)):
-        combined_path = generation_path_top[i] + generation_path_bot[i][::-1]
-        generation_path.append(combined_path)
-
-    # Set names and patterns based on plot type
-    if plot_type == PlotType.SHOW_ALL:
-        generation_name = ["燃煤", "燃氣", "燃油",
-                         "水力", "風力", "太陽能",
-                         "核能、其他再生、儲能"]
-        generation_pattern = [1, 2, 3, 4, 5, 6, 7]
-    elif plot_type == PlotType.SOLAR_AND_OTHER:
-        generation_name = ["其他", "太陽能"]
-        generation_pattern = [2, 6]
-    elif plot_type == PlotType.RENEWABLE_AND_OTHER:
-        generation_name = ["化石燃料", "再生能源"]
-        generation_pattern = [2, 6]
-    elif plot_type == PlotType.LNG_COAL_AND_OTHER:
-        generation_name = ["燃煤", "燃氣、燃油", "其他"]
-        generation_pattern = [1, 4, 6]
+    for i in range(stack.shape[1] - 1):
+        top = np.repeat(stack[:, i], 2)
+        bottom = np.repeat(stack[:, i + 1], 2)
+        path_y = np.concatenate([top, bottom[::-1]]).tolist()
+        generation_path.append(list(zip(path_x, path_y)))
 
-    # Reverse to match drawing order
-    generation_name.reverse()
-    generation_pattern.reverse()
+    ctx.save()
+    ctx.translate(CONFIG_MARGIN_LEFT, CONFIG_MARGIN_TOP)
 
     for idx, points in enumerate(generation_path):
         if not points:
@@ -329,7 +366,66 @@ def plot_generation(data, plot_type: PlotType, width: int, height: int, ditherin
         ctx.set_source_rgb(0, 0, 0)  # Black stroke
         ctx.stroke()
 
-        # Set up text style
+    ctx.restore()
+
+    # Everything that does not depend on the data comes from the chrome cache
+    chrome_key = (width, height, plot_type, dithering, time_intervals[0], time_intervals[-1])
+    chrome, chrome_lock = chrome_cache.get(
+        chrome_key,
+        lambda: record_chrome(plot_type, width, height, dithering, time_intervals))
+    with chrome_lock:
+        ctx.save()
+        ctx.set_source_surface(chrome, 0, 0)
+        ctx.paint()
+        ctx.restore()
+
+    ctx.save()
+    ctx.translate(CONFIG_MARGIN_LEFT, CONFIG_MARGIN_TOP)
+
+    # Set up text style
+    ctx.select_font_face("Sans", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+    ctx.set_font_size(12)
+
+    for value in range(0, int(max_axis_value) + 1, y_axis_steps):
+        # Calculate positions
+        scaled_value = value / 1000  # Convert to thousands
+        curr_y = chart_height - (value * value_scale) + 3
+        curr_y_line = chart_height - (value * value_scale)
+
+        # Draw label (right aligned)
+        ctx.move_to(chart_width + 1, curr_y)
+        ctx.set_source_rgb(0, 0, 0)
+        ctx.show_text(f"{int(scaled_value)}")
+
+        # Draw horizontal dashed line
+        ctx.set_source_rgb(0.8, 0.8, 0.8)  # Light gray (#ccc)
+        ctx.set_line_width(1.0)
+        ctx.set_dash([2.0, 2.0])  # 2px dash, 2px gap
+
+        ctx.move_to(0, curr_y_line)
+        ctx.line_to(chart_width, curr_y_line)
+        ctx.stroke()
+
+        # Reset dash for next operations
+        ctx.set_dash([])
+
+    ctx.restore()
+
+def draw_chrome(ctx, plot_type: PlotType, width: int, height: int, dithering: DitheringType, time_intervals):
+    chart_width = width - CONFIG_MARGIN_LEFT - CONFIG_MARGIN_RIGHT
+    chart_height = height - CONFIG_MARGIN_TOP - CONFIG_MARGIN_BOTTOM
+    bar_width = chart_width / len(time_intervals)
+
+    generation_name, generation_pattern = get_generation_legend(plot_type)
+    generation_time = []
+
+    for idx, time in enumerate(time_intervals):
+        # time is "YYYY-MM-DDTHH:MM:SS", label every 6 hours
+        if time[14:16] == "00" and int(time[11:13]) % 6 == 0:
+            formatted_time = time.replace('T', ' ')[5:16]
+            generation_time.append((idx * bar_width, formatted_time))
+
+    # Set up text style
     ctx.select_font_face("Sans", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
     ctx.set_font_size(12)
 
@@ -363,29 +459,6 @@ def plot_generation(data, plot_type: PlotType, width: int, height: int, ditherin
         # Reset dash pattern for next operations
         ctx.set_dash([])
 
-    for value in range(0, int(max_axis_value) + 1, y_axis_steps):
-        # Calculate positions
-        scaled_value = value / 1000  # Convert to thousands
-        curr_y = chart_height - (value * value_scale) + 3
-        curr_y_line = chart_height - (value * value_scale)
-
-        # Draw label (right aligned)
-        ctx.move_to(chart_width + 1, curr_y)
-        ctx.set_source_rgb(0, 0, 0)
-        ctx.show_text(f"{int(scaled_value)}")
-
-        # Draw horizontal dashed line
-        ctx.set_source_rgb(0.8, 0.8, 0.8)  # Light gray (#ccc)
-        ctx.set_line_width(1.0)
-        ctx.set_dash([2.0, 2.0])  # 2px dash, 2px gap
-
-        ctx.move_to(0, curr_y_line)
-        ctx.line_to(chart_width, curr_y_line)
-        ctx.stroke()
-
-        # Reset dash for next operations
-        ctx.set_dash([])
-
     ctx.select_font_face("Sans",
                          cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
     ctx.set_source_rgb(0, 0, 0)  # Black text
@@ -395,7 +468,7 @@ def plot_generation(data, plot_type: PlotType, width: int, height: int, ditherin
                          cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
     ctx.set_font_size(14)
     ctx.set_source_rgb(0, 0, 0)
-    x_pos = chart_width+config_margin_right
+    x_pos = chart_width+CONFIG_MARGIN_RIGHT
     y_pos = 0
     label = "百萬瓩"
     # Get text extents for proper alignment
@@ -453,10 +526,4 @@ def plot_generation(data, plot_type: PlotType, width: int, height: int, ditherin
         ctx.show_text(name)
 
         # Update x position for next item
-        curr_x += ctx.text_extents(name).width + legend_padding * 2 + legend_circle_diameter
-
-    ctx.restore()
-
-    svg_surface.finish()
-
-    return svg_path
\ No newline at end of file
+        curr_x += ctx.text_extents(name).width + legend_padding * 2 + legend_circle_diameter
\ No newline at end of file
@@ -0,0 +1,92 @@
+import struct
+import zlib
+from enum import IntEnum
+import numpy as np
+
+class EinkDithering(IntEnum):
+    FLOYD_STEINBERG = 0
+    ORDERED = 1
+    THRESHOLD = 2
+
+def bayer_matrix(order: int) -> np.ndarray:
+    """(2^order x 2^order) ordered dithering thresholds in [0, 1)."""
+    matrix = np.zeros((1, 1))
+    for _ in range(order):
+        matrix = np.block([
+            [4 * matrix + 0, 4 * matrix + 2],
+            [4 * matrix + 3, 4 * matrix + 1],
+        ])
+    return (matrix + 0.5) / matrix.size
+
+BAYER_8X8 = bayer_matrix(3)
+
+def threshold(gray: np.ndarray, levels: int) -> np.ndarray:
+    return np.clip(np.rint(gray * (levels - 1)), 0, levels - 1).astype(np.uint8)
+
+def ordered(gray: np.ndarray, levels: int) -> np.ndarray:
+    h, w = gray.shape
+    tile = np.tile(BAYER_8X8, (h // 8 + 1, w // 8 + 1))[:h, :w]
+    return np.clip(np.floor(gray * (levels - 1) + tile), 0, levels - 1).astype(np.uint8)
+
+def floyd_steinberg(gray: np.ndarray, levels: int) -> np.ndarray:
+    """
+    Error diffusion, vectorized along wavefronts: pixel (y, x) only depends on
+    pixels with a smaller x + 2y, so every pixel with the same x + 2y is
+    quantized in one step. The image is stored skewed, pixel (y, x) at
+    [x + 2y, y], which makes each wavefront a contiguous slice.
+    """
+    h, w = gray.shape
+    scale = levels - 1
+    # Spare rows and a spare column take the error that diffuses off the image
+    skewed = np.zeros((w + 2 * h + 1, h + 1))
+    ys, xs = np.indices((h, w))
+    skewed[xs + 2 * ys, ys] = gray
+    quantized = np.zeros_like(skewed)
+
+    for t in range(w + 2 * (h - 1)):
+        lo = max(0, (t - w + 2) // 2)
+        hi = min(h - 1, t // 2) + 1
+        old = skewed[t, lo:hi]
+        q = np.clip(np.rint(old * scale), 0, scale)
+        quantized[t, lo:hi] = q
+        error = old - q / scale
+        skewed[t + 1, lo:hi] += error * (7 / 16)
+        skewed[t + 1, lo + 1:hi + 1] += error * (3 / 16)
+        skewed[t + 2, lo + 1:hi + 1] += error * (5 / 16)
+        skewed[t + 3, lo + 1:hi + 1] += error * (1 / 16)
+    return quantized[xs + 2 * ys, ys].astype(np.uint8)
+
+DITHER_FUNCTIONS = {
+    EinkDithering.FLOYD_STEINBERG: floyd_steinberg,
+    EinkDithering.ORDERED: ordered,
+    EinkDithering.THRESHOLD: threshold,
+}
+
+def dither(gray: np.ndarray, bits: int, method: EinkDithering) -> np.ndarray:
+    """Quantizes luminance in 0..1 to 2^bits gray levels, 0 being black."""
+    return DITHER_FUNCTIONS[method](gray, 1 << bits)
+
+def _png_chunk(kind: bytes, payload: bytes) -> bytes:
+    chunk = kind + payload
+    return struct.pack(">I", len(payload)) + chunk + struct.pack(">I", zlib.crc32(chunk))
+
+def encode_png(levels: np.ndarray, bits: int) -> bytes:
+    """Packs level indices into a 1 or 2 bit grayscale PNG, ready for the panel."""
+    h, w = levels.shape
+    per_byte = 8 // bits
+    padded = np.zeros((h, -(-w // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :w] = levels
+    groups = padded.reshape(h, -1, per_byte)
+    # Leftmost pixel in the most significant bits
+    shifts = np.arange(per_byte - 1, -1, -1, dtype=np.uint8) * bits
+    packed = np.bitwise_or.reduce(groups << shifts, axis=2).astype(np.uint8)
+
+    # Filter type 0 (none) in front of every scanline
+    raw = np.hstack([np.zeros((h, 1), dtype=np.uint8), packed]).tobytes()
+    header = struct.pack(">IIBBBBB", w, h, bits, 0, 0, 0, 0)
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", header),
+        _png_chunk(b"IDAT", zlib.compress(raw, 6)),
+        _png_chunk(b"IEND", b""),
+    ])
@@ -0,0 +1,49 @@
+import io
+import csv
+import json
+import zlib
+from enum import Enum
+from typing import List, Sequence
+
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv; charset=utf-8",
+    ExportFormat.NDJSON: "application/x-ndjson",
+}
+
+class ExportEncoder:
+    """
+    Turns chunks of rows into bytes of CSV or NDJSON, optionally gzipped.
+    The gzip stream is continued across chunks, so each chunk can be sent
+    as soon as it is encoded.
+    """
+    def __init__(self, format: ExportFormat, columns: List[str], gzip: bool = False):
+        self.format = format
+        self.columns = columns
+        # wbits 31: zlib stream with a gzip header and trailer
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    def _compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) if self.compressor else data
+
+    def header(self) -> bytes:
+        if self.format == ExportFormat.CSV:
+            return self.encode([self.columns])
+        return b""
+
+    def encode(self, rows: Sequence[Sequence]) -> bytes:
+        if self.format == ExportFormat.CSV:
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator="\n").writerows(rows)
+            text = buffer.getvalue()
+        else:
+            text = "".join(
+                json.dumps(dict(zip(self.columns, row)), ensure_ascii=False, separators=(",", ":")) + "\n"
+                for row in rows)
+        return self._compress(text.encode())
+
+    def finish(self) -> bytes:
+        return self.compressor.flush() if self.compressor else b""
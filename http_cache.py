@@ -0,0 +1,57 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from starlette.requests import Request
+
+def to_http_date(dt: datetime) -> datetime:
+    """Naive timestamps are local time, HTTP dates are whole seconds in UTC."""
+    return dt.astimezone(timezone.utc).replace(microsecond=0)
+
+def make_etag(request: Request, *parts: str) -> str:
+    key = "|".join([request.url.path, str(sorted(request.query_params.multi_items())), *parts])
+    return 'W/"%s"' % hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as required for If-None-Match
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= last_modified
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def accepts_encoding(request: Request, coding: str) -> bool:
+    """Whether Accept-Encoding allows coding, honouring q-values and `*`."""
+    weights = {}
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.lower()] = weight
+    weight = weights.get(coding, weights.get("*", 0.0))
+    return weight > 0
+
+def cache_headers(etag: str, last_modified: Optional[datetime], max_age: int) -> Dict[str, str]:
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return headers
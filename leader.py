@@ -0,0 +1,58 @@
+import os
+import sys
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+class LeaderLock:
+    """
+    Elects one process among the server's workers to poll Taipower and write.
+    The lock is an exclusive, non-blocking lock on a file next to the
+    database. The OS drops it when the holding process exits or dies, so
+    the next worker to call try_acquire takes over.
+    Needs a local file system, flock is not reliable over NFS.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.file is not None
+
+    def try_acquire(self) -> bool:
+        if self.file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        file = open(self.path, "a+")
+        try:
+            if sys.platform == "win32":
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+
+        # For whoever looks at the volume, not read by the workers
+        file.truncate(0)
+        file.write(f"{os.getpid()}\n")
+        file.flush()
+        self.file = file
+        return True
+
+    def release(self):
+        if self.file is None:
+            return
+        try:
+            if sys.platform == "win32":
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.file.close()
+            self.file = None
@@ -1,43 +1,47 @@
 import traceback
-import re
 import os
 import json
+import time
 import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+from enum import Enum
+from typing import Optional
 import logging
 import requests
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.exceptions import RequestValidationError
-from starlette.responses import FileResponse, JSONResponse
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
 import db_helper
-
-from draw import plot_generation, PlotType, DitheringType
+from db_helper import POWER_GEN_TYPES, summary_rows_to_dict
+from render_cache import RenderCache
+from taipower import TaipowerFetcher, parse_timestamp, parse_records
+from scheduler import PollScheduler
+from leader import LeaderLock
+from shared_snapshot import Snapshot, SnapshotReader, rows_to_arrays, write_snapshot, to_summary_dict, TOTAL
+from summary_ring import SummaryRing
+from prerender import Prerenderer, parse_variants
+from broker import Broker, KEEPALIVE
+from export import ExportFormat, ExportEncoder, EXPORT_MEDIA_TYPES
+import retention
+import migrate
+import metrics
+import profiling
+from metrics import FETCH_SECONDS, PARSE_SECONDS, WRITE_SECONDS, SUMMARY_SECONDS, RENDER_SECONDS
+from http_cache import to_http_date, make_etag, is_not_modified, cache_headers, accepts_encoding
+
+from draw import plot_generation, plot_generation_gray, get_time_slot, PlotType, DitheringType
+from eink import EinkDithering, dither, encode_png
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logging.basicConfig(level = logging.INFO)
 
-POWER_GEN_TYPES = [
-    "nuclear",
-    "coal",
-    "cogen",
-    "ippcoal",
-    "lng",
-    "ipplng",
-    "oil",
-    "diesel",
-    "hydro",
-    "wind",
-    "solar",
-    "OtherRenewableEnergy",
-    "EnergyStorageSystem",
-    "EnergyStorageSystemLoad",
-]
-
 TRMNL_POWER_GEN_TYPES = [
     "nuclear",
     "coal",
@@ -54,6 +58,87 @@ TRMNL_POWER_GEN_TYPES = [
     "EnergyStorageSystem",
 ]
 
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+
+render_cache = RenderCache(RENDER_CACHE_MAX_BYTES, get_time_slot)
+poll_scheduler = PollScheduler()
+
+# Rendered into the cache after every ingest, on top of the most requested ones
+PRERENDER_VARIANTS = os.environ.get("PRERENDER_VARIANTS", "svg:780x460:0:0")
+PRERENDER_TOP = int(os.environ.get("PRERENDER_TOP", 8))
+
+prerenderer = Prerenderer(parse_variants(PRERENDER_VARIANTS), PRERENDER_TOP)
+prerender_task = None
+
+# Server-Sent Events of new snapshots, see /api/stream
+STREAM_BACKLOG = int(os.environ.get("STREAM_BACKLOG", 32))
+STREAM_KEEPALIVE = int(os.environ.get("STREAM_KEEPALIVE", 25))
+broker = Broker(STREAM_BACKLOG)
+# Tells EventSource how long to wait before reconnecting, in milliseconds
+STREAM_RETRY = b"retry: 5000\n\n"
+
+# Shortest max-age handed out, used while a snapshot is late
+CACHE_MIN_AGE = 10
+
+# Upper bound on buckets an automatic /api/summary range query returns
+SUMMARY_MAX_POINTS = int(os.environ.get("SUMMARY_MAX_POINTS", 1000))
+
+class Resolution(str, Enum):
+    AUTO = "auto"
+    RAW = "raw"
+    HOUR = "hour"
+    DAY = "day"
+    MONTH = "month"
+
+# Seconds between retention runs, none when POWER_RETENTION_DAYS is 0
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", 6 * 3600))
+
+# Rows fetched, encoded and sent at a time by /api/export
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 2000))
+
+# With several workers one of them, the holder of this lock, polls Taipower,
+# writes and pushes to TRMNL; the others only serve reads
+LEADER_LOCK_PATH = os.environ.get("LEADER_LOCK_PATH", os.path.join(os.path.dirname(db_helper.DB_PATH), "leader.lock"))
+# Seconds between a follower's checks for new snapshots and for a vacant lock
+FOLLOWER_POLL_INTERVAL = float(os.environ.get("FOLLOWER_POLL_INTERVAL", 5))
+leader_lock = LeaderLock(LEADER_LOCK_PATH)
+
+# Days of summary rows the leader keeps in memory, more than the summary window
+SUMMARY_RING_DAYS = int(os.environ.get("SUMMARY_RING_DAYS", 3))
+# Room for today on top of the full days, at one snapshot per 10 minutes
+summary_ring = SummaryRing((SUMMARY_RING_DAYS + 1) * 144)
+# The leader's latest copy of the ring, None in the other workers
+recent: Optional[Snapshot] = None
+recent_lock = threading.Lock()
+
+# The ring as the leader shares it with every worker, see shared_snapshot.py
+SHARED_SNAPSHOT_PATH = os.environ.get("SHARED_SNAPSHOT_PATH", os.path.join(os.path.dirname(db_helper.DB_PATH), "summary.snap"))
+shared_snapshot = SnapshotReader(SHARED_SNAPSHOT_PATH)
+
+RESOLUTION_STEP = {
+    Resolution.RAW:   timedelta(minutes=10),
+    Resolution.HOUR:  timedelta(hours=1),
+    Resolution.DAY:   timedelta(days=1),
+    Resolution.MONTH: timedelta(days=30),
+}
+
+# cairo work runs here so a render never blocks the event loop
+render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+# Renders in progress, so concurrent requests for one variant share a single render
+pending_renders = {}
+
+# Latest ingested timestamp, the version of everything served from the database
+data_version = None
+
+def set_data_version(timestamp):
+    global data_version
+    data_version = timestamp
+    # Every cached render is keyed by the latest ingested timestamp,
+    # moving to a new one invalidates them all.
+    render_cache.set_version(timestamp)
+
 def send_to_trmnl():
 
     try:
@@ -67,17 +152,12 @@ def send_to_trmnl():
     payload = {}
     plot_info = {}
 
-    latest_data = db_helper.get_latest_summary_record()
-    sum = 0
-    for data in latest_data:
-        sum += data['generation']
-
-    plot_info = {
-        "total_generation": int(sum),
-        "timestamp": latest_data[0]['timestamp'],
-    }
+    plot_info = get_latest_total()
+    if plot_info is None:
+        logger.warning("[send_to_trmnl] no snapshot stored yet")
+        return
 
-    curr = latest_data[0]["timestamp"]
+    curr = plot_info["timestamp"]
 
     payload['merge_variables'] = plot_info
 
@@ -103,7 +183,7 @@ def send_to_trmnl():
     # print("json size: %d" % len(json.dumps(payload)))
 
     url = "https://usetrmnl.com/api/custom_plugins/" + TRMNL_API_KEY
-    response = requests.post(url, json=payload)
+    response = requests.post(url, json=payload, timeout=(5, 15))
     logger.info(response)
     if response.status_code == 200:
         with open(TRNML_HISTORY_PATH, "w") as fp:
@@ -113,165 +193,319 @@ def send_to_trmnl():
     else:
         logger.error(response.text)
 
-def get_power_generation():
-    # Basic GET request
-    response = requests.get('https://www.taipower.com.tw/d006/loadGraph/loadGraph/data/genary.json')
-    data = None
-    pattern = r"<A NAME='(?P<type>.*)'"
+def ingest_power_generation(data):
+    try:
+        timestamp_str = parse_timestamp(data)
+    except ValueError as e:
+        logger.warning(str(e))
+        return False
 
-    # Check if the request was successful (status code 200)
-    if response.status_code == 200:
-        logger.info("taipower request successful!")
-        data = response.json()
-    else:
-        logger.warning(f"taipower request failed with status code: {response.status_code}")
+    if db_helper.has_snapshot(timestamp_str):
+        logger.info(f"[ingest_power_generation] {timestamp_str} already stored")
+        return None
 
-    if data is None:
-        return False
+    start = time.perf_counter()
+    records = parse_records(data, timestamp_str)
+    PARSE_SECONDS.observe(time.perf_counter() - start)
 
-    try:
-        datetime_obj  = datetime.strptime(data[""], "%Y-%m-%d %H:%M")
-        timestamp_str = datetime_obj.isoformat()
-    except Exception as e:
-        logger.warning(f"Invalid datetime: {data['']}")
-        return False
+    start = time.perf_counter()
+    inserted, duplicates = db_helper.insert_records(records)
+    WRITE_SECONDS.observe(time.perf_counter() - start)
+    logger.info(f"[ingest_power_generation] {timestamp_str}: {inserted} inserted, {duplicates} duplicates")
 
+    # Report the snapshot timestamp only when it brought new rows
+    return timestamp_str if inserted else None
 
-    # ["<A NAME='coal'></A><b>燃煤(Coal)</b>", '', '台中#1', '550.0', '504.1', '91.655%', '環保限制', '']
-    # ["<A NAME='coal'></A><b>燃煤(Coal)</b>", '', '小計', '10600.0(18.371%)', '8341.8(25.632%)', '', '', '']
-    # Two definiation of this data:
-    # if row[2] == "小計":
-    #   row[0] => HTML element
-    #   row[1] => ???
-    #   row[2] => Literal "小計"
-    #   row[3] => Installed capacity (in MW) and its percentage share of the total power grid.
-    #             Format: "<capacity>(<percentage>%)"
-    #   row[4] => Current net power generation (in MW) and its percentage share of total grid capacity.
-    #             Format: "<net_power_generation_MW>(<percentage_of_grid_capacity>%)"
-    #   row[5] => ???
-    #   row[6] => ???
-    #   row[7] => ???
-    # else:
-    #   row[0] => HTML element
-    #   row[1] => ???
-    #   row[2] => Power plant name
-    #   row[3] => Installed capacity (in MW)
-    #   row[4] => Current net power generation (in MW)
-    #   row[5] => Current capacity factor of power plant
-    #   row[6] => Notes
-    #   row[7] => ???
-    for row in data['aaData']:
-        is_sum = False
-        capacity = None
-        capacity_percentage = None
-        generation = None
-        generation_percentage = None
-        if '小計' in row[2]:
-            is_sum = True
-        match = re.search(pattern, row[0])
-        if not match:
-            print(f"re.search fail to match `{row[0]}` with pattern `{pattern}`. Skip this row...")
-            continue
-        power_gen_type = match.group("type")
-        if power_gen_type not in POWER_GEN_TYPES:
-            print(f"New power_gen_type `{power_gen_type}`. Skip this row...")
-            continue
-
-        if is_sum:
-            sum_pattern = r"(?P<value>.*)\((?P<percentage>.*)\%\)"
-
-            match = re.search(sum_pattern, row[3])
-            if not match:
-                print(f"is_sum: re.search fail to match `{row[3]}` with pattern `{sum_pattern}`. Skip this row...")
-                continue
-            capacity_str = match.group("value")
-            capacity_percentage_str = match.group("percentage")
-
-            match = re.search(sum_pattern, row[4])
-            if not match:
-                print(f"is_sum: re.search fail to match `{row[4]}` with pattern `{sum_pattern}`. Skip this row...")
-                continue
-            generation_str = match.group("value")
-            generation_percentage_str = match.group("percentage")
+async def get_power_generation(fetcher: TaipowerFetcher):
+    start = time.perf_counter()
+    try:
+        data = await fetcher.fetch()
+    finally:
+        FETCH_SECONDS.observe(time.perf_counter() - start)
+    if data is None:
+        logger.info("taipower snapshot not modified")
+        return None
 
+    logger.info("taipower request successful!")
+    try:
+        return await asyncio.to_thread(ingest_power_generation, data)
+    except Exception:
+        # Make sure the snapshot is downloaded again instead of answered by a 304
+        fetcher.forget()
+        raise
+
+def publish_rows(rows):
+    for timestamp, data in summary_rows_to_dict(rows).items():
+        broker.publish(timestamp, data)
+
+async def publish_snapshots(since: Optional[str]):
+    # One read per ingest, every client gets the same encoded event
+    if since is None:
+        since, _ = get_summary_window()
+    grand_arr = await asyncio.to_thread(get_summary_since, since)
+    for timestamp, data in grand_arr.items():
+        broker.publish(timestamp, data)
+
+async def on_new_snapshot(timestamp: str):
+    previous = data_version
+    set_data_version(timestamp)
+    start_prerender(timestamp)
+    await publish_snapshots(previous)
+
+async def updater():
+    fetcher = TaipowerFetcher()
+    latest = db_helper.get_latest_timestamp()
+    if latest:
+        poll_scheduler.last_snapshot = datetime.fromisoformat(latest)
+    try:
+        while True:
+            new_snapshot = None
             try:
-                capacity = float(capacity_str)
-                capacity_percentage = float(capacity_percentage_str)
-                generation = float(generation_str)
-                generation_percentage = float(generation_percentage_str)
-            except Exception as e:
-                print(traceback.format_exc())
-                continue
-        else:
-            try:
-                capacity = float(row[3])
-            except Exception as e:
-                pass
-            try:
-                generation = float(row[4])
-            except Exception as e:
-                pass
-            try:
-                generation_percentage = float(row[5][:-1])
+                new_timestamp = await get_power_generation(fetcher)
+                if new_timestamp:
+                    await asyncio.to_thread(update_recent, new_timestamp)
+                    await on_new_snapshot(new_timestamp)
+                    new_snapshot = datetime.fromisoformat(new_timestamp)
+                await asyncio.to_thread(send_to_trmnl)
             except Exception as e:
-                pass
-
-        record = db_helper.PowerGenerationRecord(
-            name = row[2],
-            type = power_gen_type,
-            timestamp = timestamp_str,
-            is_sum = is_sum,
-            capacity = capacity,
-            capacity_percentage = capacity_percentage,
-            generation = generation,
-            generation_percentage = generation_percentage,
-        )
+                logger.error(f"[updater] {traceback.format_exc()}")
 
-        db_helper.insert_record(record)
+            now = datetime.now()
+            poll_scheduler.observe(new_snapshot, now)
+            if new_snapshot:
+                logger.info(f"[updater] {poll_scheduler.stats()}")
+            await asyncio.sleep(poll_scheduler.next_delay(now))
+    finally:
+        fetcher.close()
 
-async def updater():
+async def retainer():
     while True:
         try:
-            get_power_generation()
-            send_to_trmnl()
+            report = await asyncio.to_thread(retention.run_retention)
+            logger.info(f"[retainer] {report}")
         except Exception as e:
-            logger.error(f"[updater] {traceback.format_exc()}")
-        await asyncio.sleep(150)
+            logger.error(f"[retainer] {traceback.format_exc()}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+async def migrator():
+    """
+    Leader only. Copies the rows left in power_data from before the plant_data
+    schema, oldest first and in short batches next to the ingest, resuming
+    where the last run stopped; reads cover the copied part meanwhile.
+    """
+    try:
+        copied = await asyncio.to_thread(migrate.migrate_pending)
+    except Exception as e:
+        logger.error(f"[migrator] {traceback.format_exc()}")
+        return
+    if not copied:
+        return
+
+    logger.info(f"[migrator] {copied} snapshots copied from power_data")
+    latest = await asyncio.to_thread(db_helper.get_latest_timestamp)
+    # Older rows appeared under the current data version, start over from the database
+    summary_ring.reset(0)
+    render_cache.clear()
+    if latest and (data_version is None or latest > data_version):
+        await asyncio.to_thread(update_recent, latest)
+        await on_new_snapshot(latest)
+    elif data_version is not None:
+        await asyncio.to_thread(update_recent, data_version)
+
+async def elector():
+    """
+    Follows the snapshots the leader stores until the leader lock is free,
+    then runs the ingest and retention loops in this worker.
+    """
+    while not leader_lock.try_acquire():
+        await asyncio.sleep(FOLLOWER_POLL_INTERVAL)
+        try:
+            # Following the shared snapshot keeps data_version in step with it
+            snapshot = shared_snapshot.refresh()
+            if snapshot is not None:
+                latest = snapshot.version
+            else:
+                latest = await asyncio.to_thread(db_helper.get_latest_timestamp)
+            if latest and (data_version is None or latest > data_version):
+                await on_new_snapshot(latest)
+        except Exception as e:
+            logger.error(f"[elector] {traceback.format_exc()}")
+
+    logger.info(f"[elector] worker {os.getpid()} is the leader")
+    if data_version is not None:
+        await asyncio.to_thread(update_recent, data_version)
+    tasks = [updater(), migrator()]
+    if retention.RETENTION_DAYS > 0:
+        tasks.append(retainer())
+    await asyncio.gather(*tasks)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 
-    # Startup: Create database pool
+    # Startup: Create tables, connections are opened per thread on first use
     db_helper.init_db()
-    app.state.conn = db_helper.get_db_connection()
-    print("Database pool created")
+    print("Database initialized")
+    set_data_version(db_helper.get_latest_timestamp())
+    shared_snapshot.refresh()
+    # Lets clients that were connected before a restart resume
+    if data_version is not None:
+        since = (datetime.fromisoformat(data_version) - timedelta(minutes=10 * broker.history.maxlen)).isoformat()
+        publish_rows(db_helper.get_summary_since(since))
 
-    task = asyncio.create_task(updater())
+    task = asyncio.create_task(elector())
 
     yield  # Application runs here
 
     task.cancel()
+    leader_lock.release()
+    render_executor.shutdown(wait=False, cancel_futures=True)
+    db_helper.close_db_connection()
 
-def get_summary():
+def get_summary_window():
     today = datetime.now().date()
     yesterday = today - timedelta(days=2)
     tomorrow = today + timedelta(days=1)
-    yesterday_str = yesterday.strftime("%Y-%m-%d")
-    tomorrow_str = tomorrow.strftime("%Y-%m-%d")
+    return yesterday.strftime("%Y-%m-%d"), tomorrow.strftime("%Y-%m-%d")
+
+def update_recent(version: str):
+    """
+    Leader only. Appends the summary rows stored since the newest one in the
+    ring, filling it from the database first when empty, then hands a copy
+    to this worker's readers and, through the shared snapshot, to the others.
+    """
+    global recent
+    # The ingest and the migration both call this from worker threads
+    with recent_lock:
+        last = summary_ring.last_minute()
+        if last is None:
+            since = (datetime.now().date() - timedelta(days=SUMMARY_RING_DAYS)).isoformat()
+            summary_ring.reset(db_helper.to_minutes(since))
+        else:
+            since = db_helper.from_minutes(last)
+        summary_ring.extend(*rows_to_arrays(db_helper.get_summary_since(since)))
+        recent = summary_ring.snapshot(version)
+        try:
+            write_snapshot(SHARED_SNAPSHOT_PATH, version, recent.first, recent.minutes, recent.values)
+        except Exception as e:
+            # The other workers fall back to the database until the next ingest
+            logger.error(f"[update_recent] {traceback.format_exc()}")
+
+def recent_snapshot() -> Optional[Snapshot]:
+    """The ring when leading, the shared snapshot otherwise; None if older than data_version."""
+    snapshot = recent if recent is not None else shared_snapshot.current
+    if snapshot is None or data_version is None or snapshot.version < data_version:
+        return None
+    return snapshot
+
+def read_recent(first: int):
+    """(minutes, values) of the recent rows from minute first on, None unless they are all in memory."""
+    snapshot = recent_snapshot()
+    if snapshot is None or snapshot.first > first:
+        return None
+    return snapshot.rows_from(first)
+
+def get_summary():
+    start = time.perf_counter()
+    yesterday_str, tomorrow_str = get_summary_window()
+    recent_rows = read_recent(db_helper.to_minutes(yesterday_str))
+    if recent_rows is not None:
+        grand_arr = to_summary_dict(*recent_rows)
+    else:
+        rows = db_helper.get_summary_by_time_range(yesterday_str, tomorrow_str)
+        grand_arr = summary_rows_to_dict(rows)
+    SUMMARY_SECONDS.observe(time.perf_counter() - start)
+    return grand_arr
+
+def get_summary_since(since: str):
+    """Rows after since, a timestamp as datetime.isoformat writes it without a time zone."""
+    # Never send more than the regular summary window, which starts at a
+    # date and so includes its midnight row
+    yesterday_str, _ = get_summary_window()
+    since = max(since, yesterday_str)
+    first = db_helper.to_minutes(since)
+    if len(since) >= len(db_helper.TIMESTAMP_PADDING):
+        first += 1
+    recent_rows = read_recent(first)
+    if recent_rows is not None:
+        return to_summary_dict(*recent_rows)
+    rows = db_helper.get_summary_since(since)
+    return summary_rows_to_dict(rows)
+
+def get_latest_total():
+    """Total generation of the latest snapshot, None before the first one is stored."""
+    snapshot = recent_snapshot()
+    if snapshot is not None and len(snapshot.minutes):
+        return {
+            "total_generation": int(snapshot.values[-1, TOTAL]),
+            "timestamp": db_helper.from_minutes(int(snapshot.minutes[-1])),
+        }
+
+    latest_data = db_helper.get_latest_summary_record()
+    if not latest_data:
+        return None
+    sum = 0
+    for data in latest_data:
+        sum += data['generation']
+    return {
+        "total_generation": int(sum),
+        "timestamp": latest_data[0]['timestamp'],
+    }
+
+def seconds_until_next_publish(now: datetime) -> int:
+    expected = poll_scheduler.expected_publish(now)
+    if expected is None:
+        return CACHE_MIN_AGE
+    return max(CACHE_MIN_AGE, int((expected - now).total_seconds()))
+
+def http_cache_check(request: Request, *parts: str, modified=(), expires: Optional[datetime] = None):
+    """
+    Validators and Cache-Control for a response derived from the data version.
+    Returns (headers, not_modified); nothing here touches SQLite or cairo.
+    """
+    version = data_version
+    if version is None:
+        return {"Cache-Control": "no-cache"}, False
+
+    now = datetime.now()
+    etag = make_etag(request, version, *parts)
+    last_modified = to_http_date(max([datetime.fromisoformat(version), *modified]))
+    max_age = seconds_until_next_publish(now)
+    if expires is not None:
+        max_age = min(max_age, max(1, int((expires - now).total_seconds())))
+    headers = cache_headers(etag, last_modified, max_age)
+    return headers, is_not_modified(request, etag, last_modified)
+
+def summary_cache_check(request: Request):
+    # The default window moves at midnight even without new data
+    yesterday_str, tomorrow_str = get_summary_window()
+    midnight = datetime.fromisoformat(tomorrow_str) - timedelta(days=1)
+    return http_cache_check(request, yesterday_str, modified=[midnight], expires=midnight + timedelta(days=1))
+
+def pick_resolution(start: datetime, end: datetime) -> Resolution:
+    """Finest resolution that still covers the range in SUMMARY_MAX_POINTS buckets."""
+    for resolution, step in RESOLUTION_STEP.items():
+        if (end - start) / step <= SUMMARY_MAX_POINTS:
+            return resolution
+    return Resolution.MONTH
+
+def get_summary_range(start: str, end: str, resolution: Resolution):
+    if resolution == Resolution.RAW:
+        return summary_rows_to_dict(db_helper.get_summary_by_time_range(start, end))
 
-    data = db_helper.get_sum_records_by_time_range(yesterday_str, tomorrow_str)
-    curr = data[0]["timestamp"]
     grand_arr = {}
-    arr = []
-    grand_arr.setdefault(curr, {})
-    for d in data:
-        if curr != d["timestamp"]:
-            grand_arr.setdefault(d["timestamp"], {})
-            curr = d["timestamp"]
-        grand_arr[d["timestamp"]].setdefault(d["type"], d["generation"])
+    for row in db_helper.get_rollup_by_time_range(resolution.value, start, end):
+        grand_arr.setdefault(row["bucket"], {})[row["type"]] = {
+            "avg": row["avg_generation"],
+            "min": row["min_generation"],
+            "max": row["max_generation"],
+        }
     return grand_arr
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.RequestMetricsMiddleware)
+# Not installed at all unless PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set
+if profiling.enabled():
+    app.add_middleware(profiling.ProfileMiddleware)
 
 @app.middleware("http")
 async def strip_path_prefix(request: Request, call_next):
@@ -309,35 +543,275 @@ async def static_file(request: Request):
     return FileResponse(f'www{path}')
 
 
-@app.get("/api/plot.svg")
-async def power_plant_plot(width: int = 780, height: int = 460, plot_type: PlotType = PlotType.SHOW_ALL, dithering: DitheringType = DitheringType.NONE):
+def render_plot(plot_type: PlotType, width: int, height: int, dithering: DitheringType) -> bytes:
+    grand_arr = get_summary()
+    start = time.perf_counter()
+    svg = plot_generation(grand_arr, plot_type, width, height, dithering)
+    RENDER_SECONDS.labels("svg").observe(time.perf_counter() - start)
+    return svg
+
+def render_plot_png(plot_type: PlotType, width: int, height: int, bits: int, method: EinkDithering) -> bytes:
     grand_arr = get_summary()
-    return FileResponse(plot_generation(grand_arr, plot_type, width, height, dithering), media_type="image/svg+xml")
+    # Solid grays, the panel levels come from dithering the raster
+    start = time.perf_counter()
+    gray = plot_generation_gray(grand_arr, plot_type, width, height, DitheringType.NONE)
+    png = encode_png(dither(gray, bits, method), bits)
+    RENDER_SECONDS.labels("png").observe(time.perf_counter() - start)
+    return png
+
+async def get_rendered(variant, render, *args) -> bytes:
+    key = render_cache.key(*variant)
+    body = render_cache.get(key)
+    if body is not None:
+        return body
+
+    future = pending_renders.get(key)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(render_executor, profiling.bind(render), *args)
+        pending_renders[key] = future
+        future.add_done_callback(lambda _: pending_renders.pop(key, None))
+
+    # Shielded: a client going away must not cancel a render others wait on
+    body = await asyncio.shield(future)
+    render_cache.put(key, body)
+    return body
+
+RENDERERS = {
+    "svg": render_plot,
+    "png": render_plot_png,
+}
+
+async def get_variant(variant) -> bytes:
+    """A variant is (kind, *arguments of its renderer)."""
+    kind, *args = variant
+    return await get_rendered(variant, RENDERERS[kind], *args)
+
+def start_prerender(version: str):
+    global prerender_task
+    prerender_task = asyncio.create_task(prerenderer.run(version, get_variant))
+
+def plot_cache_check(request: Request):
+    # The time axis shifts every 10 minutes even without new data
+    time_slot = get_time_slot()
+    return http_cache_check(request, time_slot.isoformat(), modified=[time_slot], expires=time_slot + timedelta(minutes=10))
+
+@app.get("/api/plot.svg")
+async def power_plant_plot(
+    request: Request,
+    width: int = Query(780, ge=64, le=2048),
+    height: int = Query(460, ge=64, le=2048),
+    plot_type: PlotType = PlotType.SHOW_ALL,
+    dithering: DitheringType = DitheringType.NONE,
+):
+    variant = ("svg", plot_type, width, height, dithering)
+    prerenderer.record(variant)
+    headers, not_modified = plot_cache_check(request)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    svg = await get_variant(variant)
+    return Response(svg, media_type="image/svg+xml", headers=headers)
+
+@app.get("/api/plot.png")
+async def power_plant_plot_png(
+    request: Request,
+    width: int = Query(800, ge=64, le=2048),
+    height: int = Query(480, ge=64, le=2048),
+    plot_type: PlotType = PlotType.SHOW_ALL,
+    bits: int = Query(1, ge=1, le=2),
+    dither: EinkDithering = EinkDithering.FLOYD_STEINBERG,
+):
+    variant = ("png", plot_type, width, height, bits, dither)
+    prerenderer.record(variant)
+    headers, not_modified = plot_cache_check(request)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    png = await get_variant(variant)
+    return Response(png, media_type="image/png", headers=headers)
 
 @app.get("/api/plot_info")
-async def power_plant_plot_info():
-    latest_data = db_helper.get_latest_summary_record()
-    sum = 0
-    for data in latest_data:
-        sum += data['generation']
-    return JSONResponse({
-        "total_generation": int(sum),
-        "timestamp": latest_data[0]['timestamp'],
+async def power_plant_plot_info(request: Request):
+    headers, not_modified = http_cache_check(request)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    plot_info = get_latest_total()
+    if plot_info is None:
+        return JSONResponse(status_code=503, content={"detail": "No data yet"}, headers={"Retry-After": "60"})
+    return JSONResponse(plot_info, headers=headers)
+
+
+@app.get("/metrics")
+async def power_plant_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/poll_stats")
+async def power_plant_poll_stats():
+    return JSONResponse({**poll_scheduler.stats(), "leader": leader_lock.is_leader, "pid": os.getpid()})
+
+@app.get("/api/stream")
+async def power_plant_stream(request: Request, since: Optional[str] = None):
+    """
+    New snapshots as Server-Sent Events, one `snapshot` event per timestamp
+    with the same per-type data as /api/summary.json. Reconnects resume from
+    Last-Event-ID (or ?since=); a `resync` event means the client missed too
+    much and should reload the summary.
+    """
+    last_event_id = request.headers.get("last-event-id") or since
+    queue = broker.subscribe(last_event_id)
+
+    async def events():
+        try:
+            yield STREAM_RETRY
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+        finally:
+            broker.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
     })
 
+@app.get("/api/stream_stats")
+async def power_plant_stream_stats():
+    return JSONResponse(broker.stats())
+
+@app.get("/api/render_cache_stats")
+async def power_plant_render_cache_stats():
+    return JSONResponse(render_cache.stats())
+
+@app.get("/api/prerender_stats")
+async def power_plant_prerender_stats():
+    return JSONResponse(prerenderer.stats())
 
 @app.get("/api/summary")
 @app.get("/api/summary.json")
-async def power_plant_summary():
-    grand_arr = get_summary()
-    return JSONResponse(grand_arr)
+async def power_plant_summary(request: Request, start: Optional[str] = None, end: Optional[str] = None, resolution: Optional[Resolution] = None, since: Optional[str] = None):
+    if since is not None:
+        try:
+            since_obj = datetime.fromisoformat(since)
+        except ValueError:
+            return JSONResponse(status_code=422, content={"detail": "Invalid request parameters"})
+        if since_obj.tzinfo is not None:
+            return JSONResponse(status_code=422, content={"detail": "Invalid request parameters"})
+        # Stored timestamps are compared as strings, "2024-05-01 10:00" must not sort before the whole day
+        since = since_obj.isoformat()
+        headers, not_modified = summary_cache_check(request)
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+
+        version = data_version
+        if version is not None and since >= version:
+            # Client is up to date, skip the database entirely
+            grand_arr = {}
+        else:
+            grand_arr = get_summary_since(since)
+        return JSONResponse({
+            "version": version,
+            "data": grand_arr,
+        }, headers=headers)
+
+    if start is None and end is None and resolution is None:
+        headers, not_modified = summary_cache_check(request)
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+
+        grand_arr = get_summary()
+        return JSONResponse(grand_arr, headers=headers)
+
+    if end is None:
+        end = (datetime.now().date() + timedelta(days=1)).isoformat()
+    try:
+        end_obj = datetime.fromisoformat(end)
+        if start is None:
+            start = (end_obj - timedelta(days=3)).date().isoformat()
+        start_obj = datetime.fromisoformat(start)
+        # Stored timestamps are naive local time, rejects bounds with a time zone
+        db_helper.to_minutes(start)
+        db_helper.to_minutes(end)
+    except ValueError:
+        return JSONResponse(status_code=422, content={"detail": "Invalid request parameters"})
+    if start_obj > end_obj:
+        return JSONResponse(status_code=422, content={"detail": "Invalid request parameters"})
+
+    if resolution in (None, Resolution.AUTO):
+        resolution = pick_resolution(start_obj, end_obj)
+
+    headers, not_modified = http_cache_check(request)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    grand_arr = await asyncio.to_thread(profiling.bind(get_summary_range), start, end, resolution)
+    return JSONResponse({
+        "start": start,
+        "end": end,
+        "resolution": resolution.value,
+        "data": grand_arr,
+    }, headers=headers)
+
+async def export_chunks(encoder: ExportEncoder, start: str, end: str, type: Optional[str], name: Optional[str]):
+    # A connection of its own: the cursor lives across chunks, and every
+    # chunk is fetched and encoded on whichever worker thread is free
+    conn = db_helper.connect(check_same_thread=False)
+    chunks = db_helper.iter_records(conn, start, end, type, name, EXPORT_CHUNK_ROWS)
+
+    def next_chunk():
+        rows = next(chunks, None)
+        return None if rows is None else encoder.encode(rows)
+
+    try:
+        yield encoder.header()
+        while True:
+            data = await asyncio.to_thread(profiling.bind(next_chunk))
+            if data is None:
+                break
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        await asyncio.to_thread(chunks.close)
+        conn.close()
+
+@app.get("/api/export")
+async def power_plant_export(request: Request, start: str, end: Optional[str] = None, format: ExportFormat = ExportFormat.CSV, type: Optional[str] = None, name: Optional[str] = None):
+    """Plant level history between start and end, streamed as CSV or NDJSON."""
+    if end is None:
+        end = (datetime.now().date() + timedelta(days=1)).isoformat()
+    try:
+        # Rejects bounds with a time zone before they are compared
+        db_helper.to_minutes(start)
+        db_helper.to_minutes(end)
+        if datetime.fromisoformat(start) > datetime.fromisoformat(end):
+            raise ValueError
+    except ValueError:
+        return JSONResponse(status_code=422, content={"detail": "Invalid request parameters"})
+
+    gzip = accepts_encoding(request, "gzip")
+    encoder = ExportEncoder(format, db_helper.EXPORT_COLUMNS, gzip)
+    filename = f"power_{start}_{end}.{format.value}".replace(":", "")
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Vary": "Accept-Encoding",
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(export_chunks(encoder, start, end, type, name),
+                             media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
 
 if __name__ == '__main__':
     app.add_middleware(GZipMiddleware, minimum_size=1000)
     import uvicorn
+    # WORKERS=4 python main.py serves from 4 processes, without reload
+    workers = int(os.environ.get("WORKERS", 1))
     uvicorn.run("main:app",
                 port=80,
                 host='0.0.0.0',
-                reload=True,
-                log_level='debug',
-                workers=1)
+                reload=workers == 1,
+                log_level='debug' if workers == 1 else 'info',
+                workers=workers)
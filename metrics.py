@@ -0,0 +1,159 @@
+"""
+Counters and histograms in the Prometheus text format, without a client library.
+
+Every thread updates a shard of its own, so recording a value is a list
+index and an add, with no lock and no allocation; /metrics adds the shards
+up. Values are per process.
+"""
+import time
+import threading
+from bisect import bisect_left
+from typing import List, Tuple
+
+# Seconds, from a cached query to a slow upstream fetch
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), register: bool = True):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        if register:
+            REGISTRY.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.help, register=False)
+
+    def _shard(self) -> List[float]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = [0] * self._shard_size()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _totals(self) -> List[float]:
+        totals = [0] * self._shard_size()
+        for shard in list(self._shards):
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+    def _series(self):
+        if self.labelnames:
+            return [(tuple(_escape(v) for v in values), child) for values, child in list(self._children.items())]
+        return [((), self)]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, metric in self._series():
+            lines.extend(metric._render_values(self.labelnames, values))
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _shard_size(self) -> int:
+        return 1
+
+    def inc(self, amount: float = 1):
+        self._shard()[0] += amount
+
+    def _render_values(self, names, values) -> List[str]:
+        return [f"{self.name}_total{_format_labels(names, values)} {self._totals()[0]}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), register: bool = True,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames, register)
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, register=False, buckets=self.buckets)
+
+    def _shard_size(self) -> int:
+        # One count per bucket, one for +Inf, then the sum
+        return len(self.buckets) + 2
+
+    def observe(self, value: float):
+        shard = self._shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def _render_values(self, names, values) -> List[str]:
+        totals = self._totals()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"), ), totals):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+            lines.append(f"{self.name}_bucket{_format_labels(names, values, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(names, values)} {totals[-1]}")
+        lines.append(f"{self.name}_count{_format_labels(names, values)} {cumulative}")
+        return lines
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+FETCH_SECONDS = Histogram("power_taipower_fetch_seconds", "Time to fetch genary.json, 304s included")
+PARSE_SECONDS = Histogram("power_parse_seconds", "Time to parse one genary.json snapshot")
+WRITE_SECONDS = Histogram("power_db_write_seconds", "Time to store one snapshot")
+SUMMARY_SECONDS = Histogram("power_get_summary_seconds", "Time to read and pivot the summary window")
+RENDER_SECONDS = Histogram("power_render_seconds", "Time to render one plot", ("format", ))
+REQUEST_SECONDS = Histogram("power_http_request_seconds", "Request latency per route", ("method", "route", "status"))
+SKIPPED_ROWS = Counter("power_skipped_rows", "genary.json rows that could not be parsed", ("reason", ))
+UNKNOWN_TYPES = Counter("power_unknown_type_rows", "genary.json rows of a power_gen_type not in POWER_GEN_TYPES", ("type", ))
+RENDER_CACHE_LOOKUPS = Counter("power_render_cache_lookups", "Rendered plot lookups in the render cache", ("result", ))
+
+class RequestMetricsMiddleware:
+    """ASGI middleware observing REQUEST_SECONDS, up to the end of the response body."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # The route template, not the path, keeps the label set bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(time.perf_counter() - start)
@@ -0,0 +1,167 @@
+"""
+Moves the rows of the original power_data table into plants / plant_data.
+
+Safe to run next to the server: rows are copied in short transactions of a
+few hundred snapshots, so the ingest writer only ever waits for one batch,
+and progress is saved after each batch so an interrupted run resumes where it
+stopped. New snapshots already go to plant_data, power_data is only read.
+The server's leader runs the copy itself at startup (see migrate_pending),
+running it by hand is only needed for --drop and --vacuum.
+
+    python migrate.py                  # copy
+    python migrate.py --drop --vacuum  # copy, verify, drop power_data and shrink the file
+"""
+import os
+import time
+import argparse
+import logging
+import sqlite3
+
+import db_helper
+
+logger = logging.getLogger(__name__)
+
+MIGRATION = "power_data"
+
+def has_legacy_table(conn: sqlite3.Connection) -> bool:
+    return conn.execute('''
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'power_data'
+    ''').fetchone() is not None
+
+def get_position(conn: sqlite3.Connection, name: str) -> str:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS migration_progress (
+            name TEXT PRIMARY KEY,
+            position TEXT NOT NULL
+        )
+    ''')
+    row = conn.execute("SELECT position FROM migration_progress WHERE name = ?", (name, )).fetchone()
+    return row["position"] if row else ""
+
+def set_position(conn: sqlite3.Connection, name: str, position: str):
+    conn.execute('''
+        INSERT INTO migration_progress (name, position) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET position = excluded.position
+    ''', (name, position))
+
+def copy_batch(conn: sqlite3.Connection, after: str, last: str):
+    """Copies every power_data row with after < timestamp <= last, in one transaction."""
+    with conn:
+        conn.execute('''
+            INSERT OR IGNORE INTO plants (name, type, is_sum)
+            SELECT name, type, MAX(is_sum)
+            FROM power_data
+            WHERE timestamp > ? AND timestamp <= ?
+            GROUP BY name, type
+        ''', (after, last))
+        conn.execute('''
+            INSERT OR IGNORE INTO plant_data (
+                ts, plant_id,
+                capacity, capacity_percentage,
+                generation, generation_percentage
+            )
+            SELECT CAST(strftime('%s', d.timestamp) AS INTEGER) / 60, p.id,
+                d.capacity, d.capacity_percentage,
+                d.generation, d.generation_percentage
+            FROM power_data d
+            JOIN plants p ON p.name = d.name AND p.type = d.type
+            WHERE d.timestamp > ? AND d.timestamp <= ?
+        ''', (after, last))
+        # Databases older than summary_by_timestamp get their summaries here
+        cursor = conn.execute('''
+            SELECT DISTINCT timestamp FROM power_data
+            WHERE timestamp > ? AND timestamp <= ? AND is_sum = 1
+        ''', (after, last))
+        db_helper._refresh_summary(conn, [row["timestamp"] for row in cursor.fetchall()])
+        set_position(conn, MIGRATION, last)
+
+def migrate(conn: sqlite3.Connection, batch: int = 500, pause: float = 0.05) -> int:
+    """Copies power_data in batches of `batch` snapshots. Returns the snapshots copied."""
+    position = get_position(conn, MIGRATION)
+    conn.commit()
+    if position:
+        logger.info(f"[migrate] resuming after {position}")
+
+    copied = 0
+    start = time.perf_counter()
+    while True:
+        timestamps = conn.execute('''
+            SELECT DISTINCT timestamp FROM power_data
+            WHERE timestamp > ?
+            ORDER BY timestamp
+            LIMIT ?
+        ''', (position, batch)).fetchall()
+        if not timestamps:
+            break
+        last = timestamps[-1]["timestamp"]
+        copy_batch(conn, position, last)
+        position = last
+        copied += len(timestamps)
+        logger.info(f"[migrate] {copied} snapshots copied, up to {position} ({time.perf_counter() - start:.1f}s)")
+        # Leaves room for the server's own writes between batches
+        time.sleep(pause)
+    return copied
+
+def migrate_pending(batch: int = 500, pause: float = 0.05) -> int:
+    """Copies what is left of power_data, if there is one, on the calling thread's connection."""
+    conn = db_helper.get_db_connection()
+    if not has_legacy_table(conn):
+        return 0
+    return migrate(conn, batch, pause)
+
+def missing_rows(conn: sqlite3.Connection) -> int:
+    return conn.execute('''
+        SELECT COUNT(*) AS missing
+        FROM power_data d
+        LEFT JOIN plants p ON p.name = d.name AND p.type = d.type
+        LEFT JOIN plant_data n
+            ON n.ts = CAST(strftime('%s', d.timestamp) AS INTEGER) / 60 AND n.plant_id = p.id
+        WHERE n.plant_id IS NULL
+    ''').fetchone()["missing"]
+
+def database_size(conn: sqlite3.Connection) -> int:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (page_count - freelist_count) * page_size
+
+def main():
+    parser = argparse.ArgumentParser(description="Move power_data into the plants / plant_data schema.")
+    parser.add_argument("--db", default=db_helper.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--batch", type=int, default=500, help="snapshots per transaction")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--drop", action="store_true", help="drop power_data once every row is copied")
+    parser.add_argument("--vacuum", action="store_true", help="rewrite the file afterwards, blocks the server while it runs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db_helper.DB_PATH = args.db
+    db_helper.init_db()
+    conn = db_helper.get_db_connection()
+    if not has_legacy_table(conn):
+        print("No power_data table, nothing to migrate")
+        return
+
+    before = database_size(conn)
+    copied = migrate(conn, args.batch, args.pause)
+    print(f"Copied {copied} snapshots")
+
+    if args.drop:
+        missing = missing_rows(conn)
+        if missing:
+            print(f"{missing} rows of power_data are missing from plant_data, keeping power_data")
+            return
+        with conn:
+            conn.execute("DROP TABLE power_data")
+            conn.execute("DELETE FROM migration_progress WHERE name = ?", (MIGRATION, ))
+        print("Dropped power_data")
+    if args.vacuum:
+        # The rewrite is also the chance to turn on incremental vacuum, see retention.py
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    print(f"Data size {before / 2**20:.1f} MiB -> {database_size(conn) / 2**20:.1f} MiB, "
+          f"file {os.path.getsize(args.db) / 2**20:.1f} MiB")
+    db_helper.close_db_connection()
+
+if __name__ == "__main__":
+    main()
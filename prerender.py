@@ -0,0 +1,95 @@
+import time
+import asyncio
+import logging
+import traceback
+from collections import Counter, deque
+from typing import List, Tuple
+
+from draw import PlotType, DitheringType
+from eink import EinkDithering
+
+logger = logging.getLogger(__name__)
+
+def parse_variants(spec: str) -> List[Tuple]:
+    """
+    Parses "svg:780x460:0:0,png:800x480:0:1:0" into render variants:
+    svg:<width>x<height>:<plot_type>:<dithering>
+    png:<width>x<height>:<plot_type>:<bits>:<dither>
+    """
+    variants = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            kind, size, *params = item.split(":")
+            width, height = (int(v) for v in size.split("x"))
+            if kind == "svg":
+                plot_type, dithering = params
+                variants.append((kind, PlotType(int(plot_type)), width, height, DitheringType(int(dithering))))
+            elif kind == "png":
+                plot_type, bits, method = params
+                variants.append((kind, PlotType(int(plot_type)), width, height, int(bits), EinkDithering(int(method))))
+            else:
+                raise ValueError(f"unknown kind {kind}")
+        except ValueError as e:
+            logger.error(f"[parse_variants] skip invalid variant `{item}`: {e}")
+    return variants
+
+class Prerenderer:
+    """
+    Warms the render cache right after an ingest. The warm set is the
+    configured variants plus the ones clients requested most; request counts
+    are halved every cycle so the set follows what devices ask for now.
+    """
+    def __init__(self, configured: List[Tuple], top: int, max_tracked: int = 1000):
+        self.configured = configured
+        self.top = top
+        self.max_tracked = max_tracked
+        self.usage = Counter()
+        self.cycles = deque(maxlen=24)
+
+    def record(self, variant: Tuple):
+        self.usage[variant] += 1
+        if len(self.usage) > self.max_tracked:
+            self.usage = Counter(dict(self.usage.most_common(self.max_tracked // 2)))
+
+    def warm_set(self) -> List[Tuple]:
+        variants = list(self.configured)
+        for variant, _ in self.usage.most_common(self.top):
+            if variant not in variants:
+                variants.append(variant)
+        return variants
+
+    def decay(self):
+        for variant in list(self.usage):
+            self.usage[variant] //= 2
+            if not self.usage[variant]:
+                del self.usage[variant]
+
+    async def run(self, version: str, render):
+        """render(variant) renders one variant into the cache."""
+        variants = self.warm_set()
+        self.decay()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(render(v) for v in variants), return_exceptions=True)
+        elapsed = time.perf_counter() - start
+
+        failed = 0
+        for variant, result in zip(variants, results):
+            if isinstance(result, Exception):
+                failed += 1
+                logger.error(f"[prerender] {variant}: {''.join(traceback.format_exception(result))}")
+        self.cycles.append({
+            "version": version,
+            "variants": len(variants),
+            "failed": failed,
+            "seconds": round(elapsed, 4),
+        })
+        logger.info(f"[prerender] {version}: {len(variants)} variants in {elapsed:.3f}s")
+
+    def stats(self) -> dict:
+        return {
+            "warm_set": [list(variant) for variant in self.warm_set()],
+            "cycles": list(self.cycles),
+        }
@@ -0,0 +1,223 @@
+"""
+Opt-in request profiling with a sampling profiler.
+
+While a profiled request runs, a background thread samples the Python stacks
+of the threads working for it every PROFILE_INTERVAL seconds: the event loop
+while it runs the request's own coroutine, and worker threads running
+functions the request handed over through bind(). Stacks are stored in the
+folded format understood by flamegraph.pl and speedscope:
+`thread;file:function;... count`.
+
+A request is profiled when
+  - it carries ?profile=1 and PROFILE_TOKEN (as ?profile_token= or the
+    X-Profile-Token header); the report is returned instead of the response;
+  - or it is picked at PROFILE_SAMPLE_RATE; its report is kept in
+    PROFILE_DIR when it took longer than PROFILE_SLOW_MS.
+
+With none of these set the middleware is not installed and costs nothing.
+"""
+import os
+import sys
+import time
+import hmac
+import random
+import logging
+import asyncio
+import threading
+import functools
+import contextvars
+from collections import Counter
+from datetime import datetime
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 1000))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join("data", "profiles"))
+# Reports kept in PROFILE_DIR, the oldest are removed
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 100))
+
+# Leaf frames of a thread that is waiting, not working
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("base_events.py", "_run_once"),
+}
+
+def enabled() -> bool:
+    return bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+def _frame_name(frame) -> str:
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+class Session:
+    """Stacks of one profiled request."""
+    def __init__(self, frame):
+        # The request's frame in the middleware, on the event loop's stack
+        # whenever the loop runs this request and no other
+        self.frame = frame
+        # Worker threads currently running a function bound to this request
+        self.threads = set()
+        self.stacks = Counter()
+
+    def owns(self, ident, frames) -> bool:
+        return ident in self.threads or any(frame is self.frame for frame in frames)
+
+# The session of the request being handled, copied into to_thread workers with the context
+current_session = contextvars.ContextVar("profile_session", default=None)
+
+def bind(func):
+    """
+    func, counted in the calling request's profile on whichever thread runs it.
+    Wrap what a request hands to an executor; without profiling it is func itself.
+    """
+    session = current_session.get()
+    if session is None:
+        return func
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        ident = threading.get_ident()
+        session.threads.add(ident)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            session.threads.discard(ident)
+    return run
+
+class Sampler:
+    """Samples the stacks of each running session's threads, sleeps while there are none."""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.sessions = {}
+        self.active = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, frame) -> Session:
+        session = Session(frame)
+        with self.lock:
+            self.sessions[id(session)] = session
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self.thread.start()
+            self.active.set()
+        return session
+
+    def stop(self, session: Session):
+        with self.lock:
+            self.sessions.pop(id(session), None)
+            if not self.sessions:
+                self.active.clear()
+
+    def sample(self, sessions):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            owners = [session for session in sessions if session.owns(ident, frames)]
+            if not owners:
+                continue
+            stack = ";".join([names.get(ident, str(ident))] + [_frame_name(frame) for frame in reversed(frames)])
+            for session in owners:
+                session.stacks[stack] += 1
+
+    def _run(self):
+        while True:
+            self.active.wait()
+            time.sleep(self.interval)
+            with self.lock:
+                sessions = list(self.sessions.values())
+            self.sample(sessions)
+
+sampler = Sampler(PROFILE_INTERVAL)
+
+def folded(session: Session) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in session.stacks.most_common())
+
+def save(report: str, path: str, elapsed_ms: float) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = path.strip("/").replace("/", "_").replace(".", "_") or "root"
+    filename = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%dT%H%M%S%f}_{name}_{int(elapsed_ms)}ms.folded")
+    with open(filename, "w") as file:
+        file.write(report)
+
+    reports = sorted(os.listdir(PROFILE_DIR))
+    for old in reports[:max(0, len(reports) - PROFILE_KEEP)]:
+        os.remove(os.path.join(PROFILE_DIR, old))
+    return filename
+
+def _token_ok(scope, query) -> bool:
+    if not PROFILE_TOKEN:
+        return False
+    token = query.get("profile_token", [""])[0]
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile-token":
+            token = value.decode("latin-1")
+    # compare_digest only takes ASCII str, bytes work for any token
+    return hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+class ProfileMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        explicit = False
+        if PROFILE_TOKEN and b"profile=" in scope.get("query_string", b""):
+            query = parse_qs(scope["query_string"].decode("latin-1"))
+            explicit = query.get("profile", [""])[0] == "1" and _token_ok(scope, query)
+        if not explicit and not (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_or_drop(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            if not explicit:
+                await send(message)
+
+        session = sampler.start(sys._getframe())
+        context = current_session.set(session)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_or_drop)
+        finally:
+            current_session.reset(context)
+            sampler.stop(session)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        if not explicit and elapsed_ms < PROFILE_SLOW_MS:
+            return
+        report = folded(session)
+        filename = await asyncio.to_thread(save, report, scope["path"], elapsed_ms)
+        logger.info(f"[profile] {scope['path']} {elapsed_ms:.1f}ms, {sum(session.stacks.values())} samples -> {filename}")
+        if explicit:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"x-profile-file", os.path.basename(filename).encode()),
+                    (b"x-profile-status", str(status).encode()),
+                    (b"x-response-time-ms", f"{elapsed_ms:.1f}".encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": report.encode()})
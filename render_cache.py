@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+from metrics import RENDER_CACHE_LOOKUPS
+
+class RenderCache:
+    """
+    LRU cache of finished plot bytes.
+    Keys start with the data version (latest ingested timestamp), so moving to
+    a new version drops every entry rendered from older data, then the time
+    slot: the plots' time axis ends at the current slot, so a new slot needs
+    a new render even without new data.
+    """
+    def __init__(self, max_bytes: int, slot: Callable[[], Hashable] = lambda: None):
+        self.max_bytes = max_bytes
+        self.slot = slot
+        self.version: Optional[str] = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, *params: Hashable) -> Tuple:
+        return (self.version, self.slot()) + params
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                RENDER_CACHE_LOOKUPS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            RENDER_CACHE_LOOKUPS.labels("hit").inc()
+            return value
+
+    def put(self, key: Tuple, value: bytes):
+        if key[0] != self.version or len(value) > self.max_bytes:
+            # Rendered from data that is already stale, or can never fit
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def set_version(self, version: Optional[str]):
+        if version == self.version:
+            return
+        with self._lock:
+            self.version = version
+            self._entries.clear()
+            self.size = 0
+
+    def clear(self):
+        """Drops every entry, for data that changed under the same version."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
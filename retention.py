@@ -0,0 +1,108 @@
+"""
+Keeps per-plant rows for POWER_RETENTION_DAYS days. Older ones are folded
+into the plant_hourly / plant_daily rollups and deleted an hour at a time,
+each hour in its own short transaction, so the ingest writer never waits for
+more than one batch. Freed pages go back to the OS through incremental vacuum.
+Plant totals (is_sum = 1) are kept.
+
+Off unless POWER_RETENTION_DAYS is set: folded rows are gone for good, so
+/api/export has no plant level history past the window, and snapshots loaded
+with backfill.py that are older than the window are folded on the next run.
+Backfill first, then turn retention on.
+
+    python retention.py --days 7       # run once
+    python retention.py --convert      # one-off: enable incremental vacuum on an older database
+"""
+import os
+import time
+import argparse
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Optional
+
+import db_helper
+
+logger = logging.getLogger(__name__)
+
+# 0 keeps every row
+RETENTION_DAYS = int(os.environ.get("POWER_RETENTION_DAYS", 0))
+# Minutes folded per transaction, a whole number of hours
+RETENTION_BATCH_MINUTES = 60
+# Pages handed back per incremental vacuum step
+VACUUM_STEP_PAGES = 256
+
+def page_stats(conn: sqlite3.Connection):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return page_size, page_count, freelist_count
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int = VACUUM_STEP_PAGES):
+    # The pragma frees one page per step, fetchall runs it to completion
+    conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+
+def run_retention(days: int = RETENTION_DAYS, now: Optional[datetime] = None, pause: float = 0.01) -> dict:
+    """Folds and deletes per-plant rows from before `days` days ago, returns a report."""
+    conn = db_helper.get_db_connection()
+    now = now or datetime.now()
+    # Whole days only, so every daily bucket is complete once folded
+    cutoff = db_helper.to_minutes((now.date() - timedelta(days=days)).isoformat())
+    incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    page_size, pages_before, _ = page_stats(conn)
+
+    report = {"cutoff": db_helper.from_minutes(cutoff), "batches": 0, "aggregated": 0, "deleted": 0}
+    start = time.perf_counter()
+    first = db_helper.get_oldest_plant_minute()
+    while first is not None and first < cutoff:
+        hour = first - first % RETENTION_BATCH_MINUTES
+        last = min(hour + RETENTION_BATCH_MINUTES, cutoff)
+        written, deleted = db_helper.rollup_plant_rows(conn, hour, last)
+        report["batches"] += 1
+        report["aggregated"] += written
+        report["deleted"] += deleted
+        if incremental:
+            incremental_vacuum(conn)
+        time.sleep(pause)
+        first = db_helper.get_oldest_plant_minute(last - 1)
+
+    if incremental:
+        # Whatever the per batch steps left behind
+        while page_stats(conn)[2]:
+            incremental_vacuum(conn)
+            time.sleep(pause)
+    _, pages_after, free_pages = page_stats(conn)
+    report["bytes_reclaimed"] = (pages_before - pages_after) * page_size
+    # Without incremental vacuum deleted pages stay in the file, reused by later writes
+    report["bytes_free"] = free_pages * page_size
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+def convert(conn: sqlite3.Connection):
+    """Switches an existing database to incremental auto vacuum. Rewrites the whole file."""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold and delete per-plant rows past the retention window.")
+    parser.add_argument("--db", default=db_helper.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS, help="days of per-plant rows to keep")
+    parser.add_argument("--convert", action="store_true", help="enable incremental vacuum first, blocks the server while it runs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db_helper.DB_PATH = args.db
+    db_helper.init_db()
+    conn = db_helper.get_db_connection()
+    if args.convert:
+        convert(conn)
+    elif conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        print("Incremental vacuum is off, freed pages are reused but the file will not shrink (see --convert)")
+    if args.days <= 0:
+        print("Retention is off, pass --days or set POWER_RETENTION_DAYS")
+    else:
+        print(run_retention(args.days))
+    db_helper.close_db_connection()
+
+if __name__ == "__main__":
+    main()
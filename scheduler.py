@@ -0,0 +1,87 @@
+import statistics
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+
+class PollScheduler:
+    """
+    Decides when to poll genary.json next.
+    Taipower publishes a snapshot every 10 minutes, some time after the
+    timestamp it carries. The scheduler learns that lag from snapshots it saw
+    appear while it was watching, sleeps until shortly before the next
+    expected publish, then polls tightly until the snapshot shows up.
+    """
+    def __init__(
+        self,
+        publish_interval: float = 600,
+        poll_interval: float = 15,
+        max_poll_interval: float = 120,
+        early: float = 30,
+        default_lag: float = 60,
+        samples: int = 36,
+    ):
+        self.publish_interval = timedelta(seconds=publish_interval)
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.early = timedelta(seconds=early)
+        self.default_lag = default_lag
+        self.lags = deque(maxlen=samples)
+        self.last_snapshot: Optional[datetime] = None
+        self.misses_in_row = 0
+        self.polls = 0
+        self.hits = 0
+
+    def lag(self) -> float:
+        """Typical seconds between a snapshot's timestamp and it being published."""
+        if not self.lags:
+            return self.default_lag
+        return statistics.median(self.lags)
+
+    def observe(self, snapshot: Optional[datetime], now: datetime):
+        """Records the outcome of one poll; snapshot is set only when it was new."""
+        self.polls += 1
+        if snapshot is None:
+            self.misses_in_row += 1
+            return
+
+        self.hits += 1
+        lag = (now - snapshot).total_seconds()
+        # Only a snapshot that appeared while we were polling for it tells
+        # us when it was published; one found after a long sleep does not.
+        if self.misses_in_row and 0 <= lag < self.publish_interval.total_seconds():
+            self.lags.append(lag)
+        self.misses_in_row = 0
+        if self.last_snapshot is None or snapshot > self.last_snapshot:
+            self.last_snapshot = snapshot
+
+    def expected_publish(self, now: datetime) -> Optional[datetime]:
+        if self.last_snapshot is None:
+            return None
+        expected = self.last_snapshot + self.publish_interval + timedelta(seconds=self.lag())
+        # A skipped publish moves the watch on to the following slot
+        while now > expected + self.publish_interval / 2:
+            expected += self.publish_interval
+        return expected
+
+    def next_delay(self, now: datetime) -> float:
+        expected = self.expected_publish(now)
+        if expected is None:
+            return self.poll_interval
+
+        window_start = expected - self.early
+        if now < window_start:
+            return (window_start - now).total_seconds()
+
+        # Inside the window poll tightly, slowing down while the snapshot is late
+        overdue = max(0.0, (now - expected).total_seconds())
+        return min(self.max_poll_interval, self.poll_interval + overdue / 4)
+
+    def stats(self) -> dict:
+        return {
+            "last_snapshot": self.last_snapshot.isoformat() if self.last_snapshot else None,
+            "publish_lag": self.lag(),
+            "lag_samples": len(self.lags),
+            "polls": self.polls,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.polls if self.polls else None,
+        }
@@ -0,0 +1,105 @@
+"""
+Recent summary rows shared by the server's workers through a memory-mapped file.
+
+The leader writes the file after every ingest and swaps it in with
+os.replace; every worker maps it read-only, so the rows live once in the
+page cache however many workers there are, and reads need no database.
+
+Layout, little endian:
+    header   magic, rows, columns, first minute covered, data version
+    minutes  int64[rows], minutes since db_helper.EPOCH, ascending
+    values   float64[rows x columns], SNAPSHOT_COLUMNS, NaN where missing
+"""
+import os
+import mmap
+import struct
+import logging
+from typing import Dict, Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from db_helper import POWER_GEN_TYPES, to_minutes
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PWRSNAP1"
+HEADER = struct.Struct("<8sIIq32s")
+SNAPSHOT_COLUMNS = POWER_GEN_TYPES + ["total"]
+TOTAL = len(POWER_GEN_TYPES)
+
+class Snapshot(NamedTuple):
+    version: str
+    # Every stored row at or after this minute is in the snapshot
+    first: int
+    minutes: np.ndarray
+    values: np.ndarray
+
+    def rows_from(self, first: int):
+        """Views of the rows at or after minute first."""
+        start = int(np.searchsorted(self.minutes, first))
+        return self.minutes[start:], self.values[start:]
+
+def rows_to_arrays(rows: Iterable[Dict]):
+    """minutes and values of db_helper summary rows."""
+    rows = list(rows)
+    minutes = np.array([to_minutes(row["timestamp"]) for row in rows], dtype="<i8")
+    values = np.array([
+        [np.nan if row[column] is None else row[column] for column in SNAPSHOT_COLUMNS]
+        for row in rows
+    ], dtype="<f8").reshape(len(rows), len(SNAPSHOT_COLUMNS))
+    return minutes, values
+
+def write_snapshot(path: str, version: str, first: int, minutes: np.ndarray, values: np.ndarray):
+    header = HEADER.pack(MAGIC, len(minutes), len(SNAPSHOT_COLUMNS), first, version.encode())
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as file:
+        file.write(header)
+        file.write(np.ascontiguousarray(minutes, dtype="<i8").tobytes())
+        file.write(np.ascontiguousarray(values, dtype="<f8").tobytes())
+    # Readers keep the mapping of the file they opened, the swap never tears a read
+    os.replace(temp, path)
+
+class SnapshotReader:
+    """
+    The latest snapshot file, mapped read-only. refresh maps a new file once
+    the leader replaced it; `current` is swapped in whole, so a reader on
+    another thread sees the old snapshot or the new one, never a mix.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.current: Optional[Snapshot] = None
+        self._key = None
+
+    def refresh(self) -> Optional[Snapshot]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.current
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self._key:
+            return self.current
+
+        try:
+            with open(self.path, "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, rows, columns, first, version = HEADER.unpack_from(mapped)
+            if magic != MAGIC or columns != len(SNAPSHOT_COLUMNS):
+                raise ValueError(f"not a snapshot of {len(SNAPSHOT_COLUMNS)} columns")
+            minutes = np.frombuffer(mapped, "<i8", rows, HEADER.size)
+            values = np.frombuffer(mapped, "<f8", rows * columns, HEADER.size + rows * 8).reshape(rows, columns)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"[SnapshotReader] ignoring {self.path}: {e}")
+            return self.current
+
+        self._key = key
+        self.current = Snapshot(version.rstrip(b"\0").decode(), first, minutes, values)
+        return self.current
+
+def to_summary_dict(minutes: np.ndarray, values: np.ndarray) -> Dict[str, Dict[str, float]]:
+    """Same shape as db_helper.summary_rows_to_dict, the total column left out."""
+    # EPOCH is the Unix epoch, so minutes are datetime64 minutes as they are
+    timestamps = np.datetime_as_string(minutes.astype("datetime64[m]"), unit="s").tolist()
+    return {
+        timestamp: {t: v for t, v in zip(POWER_GEN_TYPES, row) if v == v}
+        for timestamp, row in zip(timestamps, values[:, :TOTAL].tolist())
+    }
@@ -0,0 +1,52 @@
+import threading
+from typing import Optional
+
+import numpy as np
+
+from shared_snapshot import Snapshot, SNAPSHOT_COLUMNS
+
+class SummaryRing:
+    """
+    The newest `capacity` summary rows in fixed numpy arrays, in the column
+    layout of shared_snapshot. An append takes the slot of the oldest row
+    once the ring is full. Readers get a Snapshot, a copy in time order,
+    so an append never changes rows someone is reading.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.minutes = np.zeros(capacity, dtype="<i8")
+        self.values = np.full((capacity, len(SNAPSHOT_COLUMNS)), np.nan)
+        self.lock = threading.Lock()
+        self.reset(0)
+
+    def reset(self, first: int):
+        """Empties the ring, rows from minute first on are to be appended."""
+        with self.lock:
+            self.start = 0
+            self.size = 0
+            # Every stored row at or after this minute is in the ring
+            self.first = first
+
+    def last_minute(self) -> Optional[int]:
+        if not self.size:
+            return None
+        return int(self.minutes[(self.start + self.size - 1) % self.capacity])
+
+    def extend(self, minutes: np.ndarray, values: np.ndarray):
+        """Appends rows newer than the newest one, in time order."""
+        with self.lock:
+            for minute, row in zip(minutes, values):
+                if self.size == self.capacity:
+                    index = self.start
+                    self.first = int(self.minutes[index]) + 1
+                    self.start = (self.start + 1) % self.capacity
+                else:
+                    index = (self.start + self.size) % self.capacity
+                    self.size += 1
+                self.minutes[index] = minute
+                self.values[index] = row
+
+    def snapshot(self, version: str) -> Snapshot:
+        with self.lock:
+            order = (self.start + np.arange(self.size)) % self.capacity
+            return Snapshot(version, self.first, self.minutes[order], self.values[order])
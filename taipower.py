@@ -0,0 +1,211 @@
+import os
+import re
+import asyncio
+import random
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from db_helper import POWER_GEN_TYPES, PowerGenerationRecord
+from metrics import SKIPPED_ROWS, UNKNOWN_TYPES
+
+logger = logging.getLogger(__name__)
+
+TAIPOWER_URL = os.environ.get(
+    "TAIPOWER_URL",
+    "https://www.taipower.com.tw/d006/loadGraph/loadGraph/data/genary.json",
+)
+
+class TaipowerFetcher:
+    """
+    Fetches genary.json without blocking the event loop.
+    One pooled session is kept for the lifetime of the fetcher, and the
+    ETag / Last-Modified of the last snapshot are sent back so an unchanged
+    snapshot costs a 304 and no parsing.
+    """
+    def __init__(
+        self,
+        url: str = TAIPOWER_URL,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 15.0,
+        retries: int = 3,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+    ):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _get(self) -> Tuple[int, Dict[str, str], Optional[Dict[str, Any]]]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        data = response.json() if response.status_code == 200 else None
+        return response.status_code, response.headers, data
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter: anywhere between 0 and the exponential cap
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def forget(self):
+        """Drops the validators so the next fetch downloads the full snapshot."""
+        self.etag = None
+        self.last_modified = None
+
+    async def fetch(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns the decoded snapshot, or None when the server reports it unchanged.
+        Raises the last error once every retry has failed.
+        """
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff(attempt - 1))
+            try:
+                status_code, headers, data = await asyncio.to_thread(self._get)
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"[TaipowerFetcher] attempt {attempt + 1} failed: {e}")
+                error = e
+                continue
+
+            if status_code == 304:
+                return None
+            if status_code == 200:
+                self.etag = headers.get("ETag")
+                self.last_modified = headers.get("Last-Modified")
+                return data
+
+            logger.warning(f"[TaipowerFetcher] attempt {attempt + 1} failed with status code: {status_code}")
+            error = requests.HTTPError(f"taipower request failed with status code: {status_code}")
+            if status_code < 500 and status_code != 429:
+                break
+
+        raise error
+
+    def close(self):
+        self.session.close()
+
+TYPE_PATTERN = re.compile(r"<A NAME='(?P<type>.*)'")
+SUM_PATTERN = re.compile(r"(?P<value>.*)\((?P<percentage>.*)\%\)")
+
+def parse_timestamp(data) -> str:
+    """ISO timestamp of a genary.json snapshot, ValueError when it has none."""
+    try:
+        return datetime.strptime(data[""], "%Y-%m-%d %H:%M").isoformat()
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid datetime: {data.get('') if isinstance(data, dict) else None}") from e
+
+def parse_records(data, timestamp_str: str) -> List[PowerGenerationRecord]:
+    """One record per plant and per type sum (小計) row of a genary.json snapshot."""
+    # ["<A NAME='coal'></A><b>燃煤(Coal)</b>", '', '台中#1', '550.0', '504.1', '91.655%', '環保限制', '']
+    # ["<A NAME='coal'></A><b>燃煤(Coal)</b>", '', '小計', '10600.0(18.371%)', '8341.8(25.632%)', '', '', '']
+    # Two definiation of this data:
+    # if row[2] == "小計":
+    #   row[0] => HTML element
+    #   row[1] => ???
+    #   row[2] => Literal "小計"
+    #   row[3] => Installed capacity (in MW) and its percentage share of the total power grid.
+    #             Format: "<capacity>(<percentage>%)"
+    #   row[4] => Current net power generation (in MW) and its percentage share of total grid capacity.
+    #             Format: "<net_power_generation_MW>(<percentage_of_grid_capacity>%)"
+    #   row[5] => ???
+    #   row[6] => ???
+    #   row[7] => ???
+    # else:
+    #   row[0] => HTML element
+    #   row[1] => ???
+    #   row[2] => Power plant name
+    #   row[3] => Installed capacity (in MW)
+    #   row[4] => Current net power generation (in MW)
+    #   row[5] => Current capacity factor of power plant
+    #   row[6] => Notes
+    #   row[7] => ???
+    records = []
+    for row in data['aaData']:
+        is_sum = False
+        capacity = None
+        capacity_percentage = None
+        generation = None
+        generation_percentage = None
+        if '小計' in row[2]:
+            is_sum = True
+        match = TYPE_PATTERN.search(row[0])
+        if not match:
+            logger.warning(f"[parse_records] re.search fail to match `{row[0]}` with pattern `{TYPE_PATTERN.pattern}`. Skip this row...")
+            SKIPPED_ROWS.labels("type").inc()
+            continue
+        power_gen_type = match.group("type")
+        if power_gen_type not in POWER_GEN_TYPES:
+            logger.warning(f"[parse_records] New power_gen_type `{power_gen_type}`. Skip this row...")
+            UNKNOWN_TYPES.labels(power_gen_type).inc()
+            SKIPPED_ROWS.labels("unknown_type").inc()
+            continue
+
+        if is_sum:
+            match = SUM_PATTERN.search(row[3])
+            if not match:
+                logger.warning(f"[parse_records] is_sum: re.search fail to match `{row[3]}` with pattern `{SUM_PATTERN.pattern}`. Skip this row...")
+                SKIPPED_ROWS.labels("sum_pattern").inc()
+                continue
+            capacity_str = match.group("value")
+            capacity_percentage_str = match.group("percentage")
+
+            match = SUM_PATTERN.search(row[4])
+            if not match:
+                logger.warning(f"[parse_records] is_sum: re.search fail to match `{row[4]}` with pattern `{SUM_PATTERN.pattern}`. Skip this row...")
+                SKIPPED_ROWS.labels("sum_pattern").inc()
+                continue
+            generation_str = match.group("value")
+            generation_percentage_str = match.group("percentage")
+
+            try:
+                capacity = float(capacity_str)
+                capacity_percentage = float(capacity_percentage_str)
+                generation = float(generation_str)
+                generation_percentage = float(generation_percentage_str)
+            except Exception as e:
+                logger.exception(f"[parse_records] invalid values in `{row[2]}`. Skip this row...")
+                SKIPPED_ROWS.labels("sum_value").inc()
+                continue
+        else:
+            try:
+                capacity = float(row[3])
+            except Exception as e:
+                pass
+            try:
+                generation = float(row[4])
+            except Exception as e:
+                pass
+            try:
+                generation_percentage = float(row[5][:-1])
+            except Exception as e:
+                pass
+
+        records.append(PowerGenerationRecord(
+            name = row[2],
+            type = power_gen_type,
+            timestamp = timestamp_str,
+            is_sum = is_sum,
+            capacity = capacity,
+            capacity_percentage = capacity_percentage,
+            generation = generation,
+            generation_percentage = generation_percentage,
+        ))
+    return records
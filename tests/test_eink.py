@@ -0,0 +1,75 @@
+"""
+eink.floyd_steinberg against a plain sequential Floyd-Steinberg.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import zlib
+import struct
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eink import floyd_steinberg, encode_png
+
+def reference_floyd_steinberg(gray: np.ndarray, levels: int) -> np.ndarray:
+    """One pixel at a time, left to right, top to bottom."""
+    h, w = gray.shape
+    scale = levels - 1
+    image = gray.astype(float).copy()
+    out = np.zeros((h, w), dtype=np.uint8)
+    for y in range(h):
+        for x in range(w):
+            old = image[y, x]
+            q = min(max(np.rint(old * scale), 0), scale)
+            out[y, x] = q
+            error = old - q / scale
+            if x + 1 < w:
+                image[y, x + 1] += error * 7 / 16
+            if y + 1 < h:
+                if x > 0:
+                    image[y + 1, x - 1] += error * 3 / 16
+                image[y + 1, x] += error * 5 / 16
+                if x + 1 < w:
+                    image[y + 1, x + 1] += error * 1 / 16
+    return out
+
+class FloydSteinbergTest(unittest.TestCase):
+    def assert_matches_reference(self, gray, levels):
+        np.testing.assert_array_equal(floyd_steinberg(gray, levels), reference_floyd_steinberg(gray, levels))
+
+    def test_random_images(self):
+        rng = np.random.default_rng(1)
+        for h, w in [(1, 1), (1, 17), (17, 1), (2, 2), (7, 13), (13, 7), (32, 48)]:
+            for levels in (2, 4):
+                with self.subTest(h=h, w=w, levels=levels):
+                    self.assert_matches_reference(rng.random((h, w)), levels)
+
+    def test_flat_and_gradient(self):
+        flat = np.full((24, 40), 0.5)
+        gradient = np.tile(np.linspace(0, 1, 64), (20, 1))
+        for levels in (2, 4):
+            self.assert_matches_reference(flat, levels)
+            self.assert_matches_reference(gradient, levels)
+            self.assert_matches_reference(gradient.T.copy(), levels)
+
+    def test_keeps_mean_gray(self):
+        levels = floyd_steinberg(np.full((64, 64), 0.25), 2)
+        self.assertAlmostEqual(levels.mean(), 0.25, delta=0.01)
+
+class EncodePngTest(unittest.TestCase):
+    def test_header_and_packing(self):
+        png = encode_png(np.array([[1, 0, 1, 1, 0, 0, 0, 0, 1]], dtype=np.uint8), 1)
+        self.assertTrue(png.startswith(b"\x89PNG\r\n\x1a\n"))
+        # IHDR: width 9, height 1, bit depth 1, grayscale
+        self.assertEqual(png[16:26], b"\x00\x00\x00\x09\x00\x00\x00\x01\x01\x00")
+        length = struct.unpack(">I", png[33:37])[0]
+        self.assertEqual(png[37:41], b"IDAT")
+        # Filter byte, then the leftmost pixel in the most significant bit
+        self.assertEqual(zlib.decompress(png[41:41 + length]), bytes([0, 0b10110000, 0b10000000]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+TaipowerFetcher against a local stand-in for the genary.json server.
+
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from taipower import TaipowerFetcher, parse_timestamp, parse_records
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "genary.json")
+ETAG = '"genary-1"'
+
+class GenaryHandler(BaseHTTPRequestHandler):
+    # Set per test on the server: status codes to answer with before the
+    # snapshot, and seconds to wait before answering
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.delays:
+            time.sleep(server.delays.pop(0))
+        if server.failures:
+            self.send_response(server.failures.pop(0))
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(server.body)))
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TaipowerFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), GenaryHandler)
+        with open(FIXTURE, "rb") as file:
+            self.server.body = file.read()
+        self.server.requests = []
+        self.server.failures = []
+        self.server.delays = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{self.server.server_address[1]}/genary.json"
+        self.fetcher = TaipowerFetcher(url, connect_timeout=1, read_timeout=0.5, retries=2, backoff_base=0.01)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch(self):
+        return asyncio.run(self.fetcher.fetch())
+
+    def test_200_returns_snapshot(self):
+        data = self.fetch()
+        self.assertEqual(data, json.loads(self.server.body))
+        self.assertEqual(self.fetcher.etag, ETAG)
+        timestamp = parse_timestamp(data)
+        self.assertEqual(timestamp, "2024-05-01T13:20:00")
+        records = parse_records(data, timestamp)
+        self.assertEqual(len(records), 10)
+        self.assertEqual(sum(1 for record in records if record.is_sum), 4)
+
+    def test_304_with_if_none_match(self):
+        self.assertIsNotNone(self.fetch())
+        self.assertIsNone(self.fetch())
+        self.assertNotIn("If-None-Match", self.server.requests[0])
+        self.assertEqual(self.server.requests[1]["If-None-Match"], ETAG)
+
+        # forget() asks for the full snapshot again
+        self.fetcher.forget()
+        self.assertIsNotNone(self.fetch())
+
+    def test_5xx_is_retried(self):
+        self.server.failures = [503, 502]
+        self.assertIsNotNone(self.fetch())
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_5xx_raises_after_last_retry(self):
+        self.server.failures = [500, 500, 500]
+        with self.assertRaises(requests.HTTPError):
+            self.fetch()
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_4xx_is_not_retried(self):
+        self.server.failures = [404]
+        with self.assertRaises(requests.HTTPError):
+            self.fetch()
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_timeout_is_retried(self):
+        self.server.delays = [1.0]
+        self.assertIsNotNone(self.fetch())
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_timeout_raises_after_last_retry(self):
+        self.server.delays = [1.0, 1.0, 1.0]
+        with self.assertRaises(requests.Timeout):
+            self.fetch()
+
+if __name__ == "__main__":
+    unittest.main()